@@ -17,36 +17,219 @@
 Mirroring and osSensor traffic."""
 
 from common import (
+    FixedOrPercent,
+    TemplateName,
     prefixURLCompute,
     getRef,
     GenerateOSSensorLBIP,
-    GCP_CLOUD_OPS_TEMPLATE,
+    GenerateCloudOpsConfig,
+    VSENSOR_BOOT_TIMING_SCRIPT,
+    VSENSOR_PCAP_PATH,
 )
 
 
-def GenerateConfig(context):
-    name = context.env["name"]
-    project = context.env["project"]
+def GenerateAutoscalingPolicy(gprop):
+    """Autoscaling policy for the vSensor MIG, scaling on CPU and/or ingest metrics."""
+    policy = {
+        "minNumReplicas": gprop["mig-min-size"],
+        "maxNumReplicas": gprop["mig-max-size"],
+        "scaleDownControl": {
+            "maxScaledDownReplicas": FixedOrPercent(
+                gprop["mig-autoscale-scale-in-max-replicas"]
+            ),
+            "timeWindowSec": gprop["mig-autoscale-scale-in-window-secs"],
+        },
+        "coolDownPeriodSec": gprop["mig-autoscale-cool-down-secs"],
+    }
 
-    # Template properties
+    if gprop["mig-autoscale-cpu-target"] > 0:
+        policy["cpuUtilization"] = {
+            "utilizationTarget": gprop["mig-autoscale-cpu-target"],
+            "predictiveMethod": gprop["mig-autoscale-predictive"],
+        }
+
+    # Packet mirroring load is seen on the NIC before it shows as CPU. The autoscaler
+    # follows whichever signal recommends the most instances.
+    custom_metrics = []
+    if "mig-autoscale-received-bytes-per-sec" in gprop:
+        custom_metrics.append(
+            {
+                "metric": "compute.googleapis.com/instance/network/received_bytes_count",
+                "utilizationTarget": gprop["mig-autoscale-received-bytes-per-sec"],
+                "utilizationTargetType": "DELTA_PER_SECOND",
+            }
+        )
+    if "mig-autoscale-received-packets-per-sec" in gprop:
+        custom_metrics.append(
+            {
+                "metric": "compute.googleapis.com/instance/network/received_packets_count",
+                "utilizationTarget": gprop["mig-autoscale-received-packets-per-sec"],
+                "utilizationTargetType": "DELTA_PER_SECOND",
+            }
+        )
+    for custom_metric in gprop["mig-autoscale-custom-metrics"]:
+        metric = {
+            "metric": custom_metric["metric"],
+            "utilizationTarget": custom_metric["target"],
+            "utilizationTargetType": custom_metric.get("target-type", "GAUGE"),
+        }
+        if "filter" in custom_metric:
+            metric["filter"] = custom_metric["filter"]
+        custom_metrics.append(metric)
+    if custom_metrics:
+        policy["customMetricUtilizations"] = custom_metrics
+
+    # Scheduled minimum sizes, so capacity is warm before predictable traffic peaks.
+    scaling_schedules = {}
+    for schedule in gprop["scaling-schedules"]:
+        scaling_schedules[schedule["name"]] = {
+            "schedule": schedule["schedule"],
+            "timeZone": schedule.get("time-zone", "UTC"),
+            "durationSec": schedule["duration-secs"],
+            "minRequiredReplicas": schedule["min-replicas"],
+            "description": schedule.get("description", ""),
+        }
+    if scaling_schedules:
+        policy["scalingSchedules"] = scaling_schedules
+
+    return policy
+
+
+def GenerateUpdatePolicy(gprop, min_ready_sec):
+    """Rolling update policy. Surging replacements in before removing vSensors keeps the
+    ingest capacity of the group through template changes."""
+    policy = {
+        "type": gprop["mig-update-type"],
+        "minimalAction": "REPLACE",
+        "minReadySec": min_ready_sec,
+    }
+    if "mig-update-max-surge" in gprop:
+        policy["maxSurge"] = FixedOrPercent(gprop["mig-update-max-surge"])
+    if "mig-update-max-unavailable" in gprop:
+        policy["maxUnavailable"] = FixedOrPercent(gprop["mig-update-max-unavailable"])
+    return policy
+
+
+def GenerateAlertPolicies(project, name, mig_name, base_name, gprop):
+    """Alerting policies for a vSensor group reaching its scaling ceiling or saturating."""
+    duration = "{}s".format(gprop["alert-duration-secs"])
+    notification_channels = [
+        channel
+        if channel.startswith("projects/")
+        else "projects/{}/notificationChannels/{}".format(project, channel)
+        for channel in gprop["alert-notification-channels"]
+    ]
+    vsensors = 'resource.type = "gce_instance" AND metadata.system_labels.name = starts_with("{}")'.format(
+        base_name
+    )
+
+    def alert_policy(policy_name, display_name, documentation, condition):
+        policy = {
+            "name": policy_name,
+            "type": "gcp-types/monitoring-v3:projects.alertPolicies",
+            "properties": {
+                "displayName": "vSensor {}: {}".format(mig_name, display_name),
+                "documentation": {"content": documentation, "mimeType": "text/markdown"},
+                "combiner": "OR",
+                "conditions": [dict(condition, displayName=display_name)],
+                "notificationChannels": notification_channels,
+            },
+        }
+        if "conditionMatchedLog" in condition:
+            # Log match conditions notify at most this often.
+            policy["properties"]["alertStrategy"] = {
+                "notificationRateLimit": {"period": "3600s"}
+            }
+        return policy
+
+    def threshold(metric_filter, value, aligner, reducer=None):
+        aggregation = {"alignmentPeriod": "60s", "perSeriesAligner": aligner}
+        if reducer:
+            aggregation["crossSeriesReducer"] = reducer
+        return {
+            "conditionThreshold": {
+                "filter": metric_filter,
+                "aggregations": [aggregation],
+                "comparison": "COMPARISON_GT",
+                "thresholdValue": value,
+                "duration": duration,
+                "trigger": {"count": 1},
+            }
+        }
+
+    policies = [
+        alert_policy(
+            name + "-alert-nic-errors",
+            "NIC receive errors",
+            "vSensors are failing to receive packets, so are likely saturated.",
+            threshold(
+                'metric.type = "agent.googleapis.com/interface/errors" AND metric.labels.direction = "rx" AND '
+                + vsensors,
+                gprop["alert-nic-errors-per-sec"],
+                "ALIGN_RATE",
+            ),
+        ),
+        alert_policy(
+            name + "-alert-unhealthy",
+            "unhealthy vSensors",
+            "vSensors are failing the collector load balancer health check, so mirrored traffic sent to them is lost until they are healed.",
+            {
+                "conditionMatchedLog": {
+                    "filter": 'logName = "projects/{}/logs/compute.googleapis.com%2Fhealthchecks" AND resource.labels.instance_group_name = "{}" AND jsonPayload.healthCheckProbeResult.healthState = "UNHEALTHY"'.format(
+                        project, mig_name
+                    )
+                }
+            },
+        ),
+    ]
+    # A fixed size group is always at its maximum.
+    if gprop["mig-max-size"] > gprop["mig-min-size"]:
+        policies.append(
+            alert_policy(
+                name + "-alert-max-size",
+                "pinned at mig-max-size",
+                "The vSensor Managed Instance Group has been at its maximum size, so mirrored traffic above its capacity is dropped. Raise mig-max-size or use larger vSensors (see capacity_planner.py).",
+                threshold(
+                    'metric.type = "compute.googleapis.com/instance_group/size" AND resource.type = "instance_group" AND resource.labels.instance_group_name = "{}"'.format(
+                        mig_name
+                    ),
+                    # Size is a whole number, so above max - 1 is at max.
+                    gprop["mig-max-size"] - 1,
+                    "ALIGN_MIN",
+                ),
+            )
+        )
+    if gprop["mig-autoscale-cpu-target"] > 0:
+        policies.append(
+            alert_policy(
+                name + "-alert-cpu",
+                "CPU above the autoscale target",
+                "Average vSensor CPU has stayed above the autoscale target, so the group is not scaling out fast enough (or is at mig-max-size).",
+                threshold(
+                    'metric.type = "compute.googleapis.com/instance/cpu/utilization" AND '
+                    + vsensors,
+                    gprop["mig-autoscale-cpu-target"],
+                    "ALIGN_MEAN",
+                    "REDUCE_MEAN",
+                ),
+            )
+        )
+    return policies
+
+
+def GenerateInstanceTemplate(context, template_name, gprop):
+    """vSensor instance template of a group's launch properties, named after a hash of its body
+    (see common.TemplateName)."""
     prop = context.properties
-    gprop = prop["global"]
 
     vpc_ref = prop["vpc-ref"]
     subnet_ref = prop["subnet-ref"]
-    health_check_name = prop["healthcheck-name"]
     service_account_email = prop["service-account-email"]
     # GCP detects this as a dependency, so remove dependency if PCAP storage should be disabled
     pcap_bucket_name = (
         prop["pcap-bucket-name"] if (gprop["pcap-retention-time-days"] != 0) else ""
     )
 
-    zone_1 = prefixURLCompute(context, "zones/" + gprop["zone1"])
-    zone_2 = prefixURLCompute(context, "zones/" + gprop["zone2"])
-
-    region = gprop["region"]
-    min_size = gprop["mig-min-size"]
-    max_size = gprop["mig-max-size"]
     instance_type = gprop["mig-instance-type"]
     vsensor_update_key = gprop["vsensor-update-key"]
     appliance_push_token = gprop["appliance-push-token"]
@@ -56,16 +239,147 @@ def GenerateConfig(context):
     mig_subnet_cidr = gprop["mig-subnet-cidr"]
     username_sshkey = gprop["mig-ssh-user-key"] if "mig-ssh-user-key" in gprop else None
     ipv6 = gprop["ipv6-enable"]
+    prebaked_image = (
+        gprop["mig-prebaked-image"] if "mig-prebaked-image" in gprop else None
+    )
+    boot_timing_enable = gprop["mig-boot-timing-enable"]
+    ops_agent_logging = gprop["ops-agent-logging"]
+    local_ssd_count = gprop["mig-local-ssd-count"]
+    disk_type = gprop["mig-disk-type"]
+    disk_size_gb = gprop["mig-disk-size-gb"]
+    disk_provisioned_iops = (
+        gprop["mig-disk-provisioned-iops"]
+        if "mig-disk-provisioned-iops" in gprop
+        else None
+    )
+    disk_provisioned_throughput = (
+        gprop["mig-disk-provisioned-throughput"]
+        if "mig-disk-provisioned-throughput" in gprop
+        else None
+    )
+    nic_type = gprop["mig-nic-type"]
+    tier1_networking = gprop["mig-tier1-networking"]
+    min_cpu_platform = (
+        gprop["mig-min-cpu-platform"] if "mig-min-cpu-platform" in gprop else None
+    )
+    threads_per_core = (
+        gprop["mig-threads-per-core"] if "mig-threads-per-core" in gprop else None
+    )
     ossensor_lb_ip = GenerateOSSensorLBIP(mig_subnet_cidr)
 
-    BASE_NAME = name + "-vsensor"
-    MIG_NAME = name + "-group"
-    INSTANCE_TEMPLATE_NAME = name + "-template"
-    INSTANCE_TEMPLATE_V2_NAME = INSTANCE_TEMPLATE_NAME + "-v2"
-
     # https://cloud.google.com/compute/docs/reference/rest/v1/instanceTemplates/insert
 
-    def instance_template_factory(name, image):
+    def instance_template_factory(
+        name,
+        image,
+        prebaked=False,
+        boot_timing=False,
+        ops_agent_logging=None,
+        local_ssd_count=0,
+    ):
+        # Continuation lines of the commands below must match the startup script indentation.
+        script_indent = " " * 26
+
+        # Starts a timed startup script stage, prefixing the stage's first command.
+        def boot_stage(stage, indent=script_indent):
+            return "boot_stage {}\n{}".format(stage, indent) if boot_timing else ""
+
+        boot_timing_setup = ""
+        boot_timing_end = ""
+        if boot_timing:
+            boot_timing_setup = "\n".join(
+                script_indent + line if line else line
+                for line in VSENSOR_BOOT_TIMING_SCRIPT.split("\n")
+            )
+            boot_timing_end = "boot_stage_end ok\n" + script_indent
+
+        # Local SSDs (striped if several) are scratch space for PCAPs before upload. They are
+        # formatted when new, then mounted over the vSensor PCAP directory once the vSensor is
+        # installed (so the directory exists, with the ownership and mode the vSensor package gives
+        # it) and before it is configured. A missing directory fails the boot rather than leaving
+        # PCAPs on the boot disk. On a reboot the existing array is assembled again (by Ubuntu as
+        # /dev/md127) and reused.
+        local_ssd_setup = ""
+        if local_ssd_count:
+            if local_ssd_count > 1:
+                local_ssd_device = [
+                    "LOCAL_SSD_DEVICE=$(awk '/^md/ {print \"/dev/\" $1; exit}' /proc/mdstat)",
+                    'if [ -z "$LOCAL_SSD_DEVICE" ]; then',
+                    "  mdadm --assemble --scan || true",
+                    "  LOCAL_SSD_DEVICE=$(awk '/^md/ {print \"/dev/\" $1; exit}' /proc/mdstat)",
+                    "fi",
+                    'if [ -z "$LOCAL_SSD_DEVICE" ]; then',
+                    "  mdadm --create /dev/md0 --level=0 --raid-devices={} --force --run /dev/disk/by-id/google-local-nvme-ssd-*".format(
+                        local_ssd_count
+                    ),
+                    "  LOCAL_SSD_DEVICE=/dev/md0",
+                    "fi",
+                ]
+            else:
+                local_ssd_device = [
+                    "LOCAL_SSD_DEVICE=/dev/disk/by-id/google-local-nvme-ssd-0"
+                ]
+            local_ssd_setup = (
+                ("\n" + script_indent).join(
+                    [
+                        boot_stage("local-ssd")
+                        + 'echo "Mounting local SSDs as the vSensor PCAP directory {}"'.format(
+                            VSENSOR_PCAP_PATH
+                        )
+                    ]
+                    + local_ssd_device
+                    + [
+                        'blkid "$LOCAL_SSD_DEVICE" || mkfs.ext4 -F -m 0 -E lazy_itable_init=0,lazy_journal_init=0,discard "$LOCAL_SSD_DEVICE"',
+                        'if [ ! -d {0} ]; then echo "vSensor PCAP directory {0} not found after installation"; exit 1; fi'.format(
+                            VSENSOR_PCAP_PATH
+                        ),
+                        "PCAP_OWNER=$(stat -c %u:%g {0}) PCAP_MODE=$(stat -c %a {0})".format(
+                            VSENSOR_PCAP_PATH
+                        ),
+                        'mount -o discard,defaults,nobarrier "$LOCAL_SSD_DEVICE" '
+                        + VSENSOR_PCAP_PATH,
+                        'chown "$PCAP_OWNER" {0} && chmod "$PCAP_MODE" {0}'.format(
+                            VSENSOR_PCAP_PATH
+                        ),
+                    ]
+                )
+                + "\n"
+                + script_indent
+            )
+
+        if prebaked:
+            ops_agent_install = 'echo "Starting userdata, Cloud OPS agent is pre-installed in the image"'
+            vsensor_install = 'echo "Skipping vSensor installation, pre-installed in the image"'
+        else:
+            # The startup script re-runs at every boot, so installs are skipped once done (ie when a
+            # stopped standby vSensor is started).
+            ops_agent_install = "\n".join(
+                [
+                    "if dpkg -s google-cloud-ops-agent >/dev/null 2>&1; then",
+                    script_indent
+                    + '  echo "Starting userdata, Cloud OPS agent is already installed"',
+                    script_indent + "else",
+                    script_indent
+                    + '  echo "Starting userdata, installing Cloud OPS agent for logging"',
+                    script_indent
+                    + "  curl -sSO https://dl.google.com/cloudagents/add-google-cloud-ops-agent-repo.sh",
+                    script_indent + "  bash add-google-cloud-ops-agent-repo.sh --also-install",
+                    script_indent + "fi",
+                ]
+            )
+            vsensor_install = "\n".join(
+                [
+                    "if command -v set_updatekey.sh >/dev/null; then",
+                    script_indent + '  echo "Skipping vSensor installation, already installed"',
+                    script_indent + "else",
+                    script_indent + '  echo "Starting vSensor installation"',
+                    script_indent
+                    + "  bash <(wget -O - https://packages.darktrace.com/install) --updateKey "
+                    + vsensor_update_key,
+                    script_indent + "fi",
+                ]
+            )
+
         return {
             "name": name,
             "type": "compute.v1.instanceTemplate",
@@ -108,8 +422,8 @@ def GenerateConfig(context):
                     ],
                     "metadata": {
                         "items": [
-                            # Do not adjust the indentation of the script contents! Instance templates are
-                            # immutable, so adjusting the whitespace will cause deployment updates to fail.
+                            # Do not adjust the indentation of the script contents! Instance templates are named after
+                            # their contents, so adjusting the whitespace will replace every instance.
                             # autopep8: off
                             {
                                 "key": "startup-script",
@@ -128,34 +442,31 @@ def GenerateConfig(context):
 
                           exec > >(tee -a /var/log/user-data.log|logger -t user-data -s 2>/dev/console) 2>&1
 
-                          trap exittrap EXIT
+                          trap exittrap EXIT{boot_timing_setup}
                           
-                          echo "Starting userdata, installing Cloud OPS agent for logging"
-                          curl -sSO https://dl.google.com/cloudagents/add-google-cloud-ops-agent-repo.sh
-                          bash add-google-cloud-ops-agent-repo.sh --also-install
-                          cat >/etc/google-cloud-ops-agent/config.yaml <<EOF
-                            {GCP_CLOUD_OPS_TEMPLATE}
+                          {boot_stage('ops-agent-install')}{ops_agent_install}
+                          {boot_stage('ops-agent-config')}cat >/etc/google-cloud-ops-agent/config.yaml <<'EOF'
+                            {GenerateCloudOpsConfig(boot_timing, ops_agent_logging)}
 EOF
                           service google-cloud-ops-agent restart
                           echo "Completed Google Cloud Ops Configuration"
-                          echo "Starting vSensor installation"
-                          bash <(wget -O - https://packages.darktrace.com/install) --updateKey {vsensor_update_key}
-                          echo "Setting configuration"
+                          {boot_stage('vsensor-install')}{vsensor_install}
+                          {local_ssd_setup}echo "Setting configuration"
                           #set updatekey, upgrade and enable daily updates
-                          set_updatekey.sh {vsensor_update_key}
-                          set_pushtoken.sh {appliance_push_token} {appliance_hostname}:{appliance_port}
-                          set_ossensor_loadbalancer_direct.sh 1 # Allow osSensors to work via load balancer
-                          set_ephemeral.sh 1 # Configure vSensor for use in ASG.
+                          {boot_stage('set-updatekey')}set_updatekey.sh {vsensor_update_key}
+                          {boot_stage('set-pushtoken')}set_pushtoken.sh {appliance_push_token} {appliance_hostname}:{appliance_port}
+                          {boot_stage('set-ossensor-loadbalancer-direct')}set_ossensor_loadbalancer_direct.sh 1 # Allow osSensors to work via load balancer
+                          {boot_stage('set-ephemeral')}set_ephemeral.sh 1 # Configure vSensor for use in ASG.
                           if [ -n "{ossensor_hmac}" ]; then
-                            set_ossensor_hmac.sh {ossensor_hmac}
+                            {boot_stage('set-ossensor-hmac', script_indent + '  ')}set_ossensor_hmac.sh {ossensor_hmac}
                             set_gcp_lb_ip.sh "{ossensor_lb_ip}"
                           fi
-                          if [ -n "{pcap_bucket_name}" ]; then
+                          {boot_stage('set-pcap')}if [ -n "{pcap_bucket_name}" ]; then
                             set_pcap_gcp_bucket.sh "{pcap_bucket_name}" "{service_account_email}"
                           else
                             set_pcap_size.sh 0
                           fi
-                          echo "Completed vSensor configuration"
+                          {boot_timing_end}echo "Completed vSensor configuration"
                         """,
                             }
                             # autopep8: on
@@ -165,36 +476,159 @@ EOF
             },
         }
 
-    instance_templates = [
-        instance_template_factory(
-            INSTANCE_TEMPLATE_V2_NAME,
-            "projects/ubuntu-os-cloud/global/images/family/ubuntu-2404-lts-amd64",
-        )
-    ]
+    instance_template = instance_template_factory(
+        template_name,
+        prebaked_image
+        if prebaked_image
+        else "projects/ubuntu-os-cloud/global/images/family/ubuntu-2404-lts-amd64",
+        prebaked=bool(prebaked_image),
+        boot_timing=boot_timing_enable,
+        ops_agent_logging=ops_agent_logging,
+        local_ssd_count=local_ssd_count,
+    )
 
-    # We need to keep this around during Focal->Noble upgrade because instance templates are immutable.
-    # Effectively we make a new template, then switch the MIG to use the new one, then in a separate update remove the old one.
-    if gprop.get("vsensor-63-upgrade-in-progress", False):
-        instance_templates.append(
-            instance_template_factory(
-                INSTANCE_TEMPLATE_NAME,
-                "projects/ubuntu-os-cloud/global/images/family/ubuntu-2004-lts",
-            )
-        )
+    # High bandwidth options. These are only added when set.
+    template_properties = instance_template["properties"]["properties"]
+    # Persistent disk performance scales with the disk size and type.
+    boot_disk = template_properties["disks"][0]["initializeParams"]
+    boot_disk["diskSizeGb"] = disk_size_gb
+    boot_disk["diskType"] = disk_type
+    if disk_provisioned_iops:
+        boot_disk["provisionedIops"] = disk_provisioned_iops
+    if disk_provisioned_throughput:
+        boot_disk["provisionedThroughput"] = disk_provisioned_throughput
+    if nic_type == "GVNIC":
+        template_properties["networkInterfaces"][0]["nicType"] = "GVNIC"
+    if tier1_networking:
+        template_properties["networkPerformanceConfig"] = {
+            "totalEgressBandwidthTier": "TIER_1"
+        }
+    if min_cpu_platform:
+        template_properties["minCpuPlatform"] = min_cpu_platform
+    if threads_per_core:
+        template_properties["advancedMachineFeatures"] = {
+            "threadsPerCore": threads_per_core
+        }
+    template_properties["disks"].extend(
+        {
+            "type": "SCRATCH",
+            "autoDelete": True,
+            "interface": "NVME",
+            "initializeParams": {"diskType": "local-ssd"},
+        }
+        for _ in range(local_ssd_count)
+    )
 
     # Because pcap_bucket_name is optional above, it doesn't detect the dependency implicitly.
     # Add it explicitly here. This gets appended to the implict ones for the VPC, Subnet and Service Account.
-    for instance_template in instance_templates:
-        if pcap_bucket_name:
-            instance_template["metadata"] = {"dependsOn": [pcap_bucket_name]}
+    if pcap_bucket_name:
+        instance_template["metadata"] = {"dependsOn": [pcap_bucket_name]}
+
+    if username_sshkey:
+        template_properties["metadata"]["items"].append(
+            {"key": "ssh-keys", "value": username_sshkey}
+        )
+
+    # Instance templates are immutable, so name the template after its body. Any change makes a new
+    # template for the MIG to roll over to (see the previous template in GenerateConfig).
+    instance_template["name"] = TemplateName(template_name, instance_template)
+    return instance_template
+
+
+def GenerateConfig(context):
+    name = context.env["name"]
+    project = context.env["project"]
+    deployment = context.env["deployment"]
+
+    # Template properties
+    prop = context.properties
+    gprop = prop["global"]
+
+    health_check_name = prop["healthcheck-name"]
+
+    zone_1 = prefixURLCompute(context, "zones/" + gprop["zone1"])
+    zone_2 = prefixURLCompute(context, "zones/" + gprop["zone2"])
+
+    region = gprop["region"]
+    prebaked_image = (
+        gprop["mig-prebaked-image"] if "mig-prebaked-image" in gprop else None
+    )
+    boot_timing_enable = gprop["mig-boot-timing-enable"]
+    canary_size = (
+        gprop["mig-update-canary-size"] if "mig-update-canary-size" in gprop else None
+    )
+    standby_stopped_size = gprop["mig-standby-stopped-size"]
+    standby_suspended_size = gprop["mig-standby-suspended-size"]
+
+    BASE_NAME = name + "-vsensor"
+    MIG_NAME = name + "-group"
+    INSTANCE_TEMPLATE_NAME = name + "-template"
+    BOOT_TIMING_METRIC_NAME = name + "-boot-stage-duration"
+
+    # A pre-baked image only applies per-deployment settings at boot, so is healthy and ready far sooner.
+    autohealing_initial_delay_sec = 300 if prebaked_image else 600
+    min_ready_sec = 60 if prebaked_image else 180
 
-        if username_sshkey:
-            instance_template["properties"]["properties"]["metadata"]["items"].append(
-                {"key": "ssh-keys", "value": username_sshkey}
+    instance_template = GenerateInstanceTemplate(context, INSTANCE_TEMPLATE_NAME, gprop)
+    instance_template_name = instance_template["name"]
+    resources = [instance_template]
+
+    # Any change to the template body renames it, so Deployment Manager would delete the previous
+    # template in the same update that rolls the MIG onto the new one, while vSensors still use it.
+    # Regenerating the previous template from the launch properties it was made with keeps it until
+    # a later update (without mig-previous-template) deletes it.
+    previous_template_name = None
+    if "previous-global" in prop:
+        previous_template = GenerateInstanceTemplate(
+            context, INSTANCE_TEMPLATE_NAME, prop["previous-global"]
+        )
+        previous_template_name = previous_template["name"]
+        if (
+            "previous-template-name" in prop
+            and prop["previous-template-name"] != previous_template_name
+        ):
+            raise Exception(
+                "mig-previous-template properties make instance template {}, not {}. Give the launch properties the previous template was made with.".format(
+                    previous_template_name, prop["previous-template-name"]
+                )
             )
+        if previous_template_name != instance_template_name:
+            resources.append(previous_template)
+        else:
+            previous_template_name = None
+
+    mig_versions = {"instanceTemplate": getRef(instance_template_name)}
+    # Canary the current template on some vSensors, the rest stay on the previous template.
+    if canary_size is not None and previous_template_name:
+        mig_versions = {
+            "versions": [
+                {
+                    "name": "stable",
+                    "instanceTemplate": getRef(previous_template_name),
+                },
+                {
+                    "name": "canary",
+                    "instanceTemplate": getRef(instance_template_name),
+                    "targetSize": FixedOrPercent(canary_size),
+                },
+            ]
+        }
+
+    # Keep initialized vSensors stopped/suspended for the autoscaler to start or resume before creating
+    # new ones. vSensors join the pool once initialized, after the same delay as autohealing.
+    standby_options = {}
+    if standby_stopped_size or standby_suspended_size:
+        standby_options = {
+            "standbyPolicy": {
+                "mode": "SCALE_OUT_POOL",
+                "initialDelaySec": autohealing_initial_delay_sec,
+            },
+            "targetStoppedSize": standby_stopped_size,
+            "targetSuspendedSize": standby_suspended_size,
+        }
 
     # Use BETA for minReadySec: https://cloud.google.com/compute/docs/reference/rest/beta/instanceGroupManagers
-    resources = [
+    resources[:0] = [
         {
             "name": MIG_NAME,
             "type": "compute.beta.regionInstanceGroupManager",
@@ -206,14 +640,14 @@ EOF
                 # Initial spin up only one vSensor, it will setup the shared storage HMAC key before any others scale up for load.
                 "targetSize": 1,
                 "baseInstanceName": BASE_NAME,
-                "instanceTemplate": getRef(INSTANCE_TEMPLATE_V2_NAME),
-                "updatePolicy": {
-                    "type": "PROACTIVE",
-                    "minimalAction": "REPLACE",
-                    "minReadySec": 180,
-                },
+                **mig_versions,
+                **standby_options,
+                "updatePolicy": GenerateUpdatePolicy(gprop, min_ready_sec),
                 "autoHealingPolicies": [
-                    {"healthCheck": getRef(health_check_name), "initialDelaySec": 600}
+                    {
+                        "healthCheck": getRef(health_check_name),
+                        "initialDelaySec": autohealing_initial_delay_sec,
+                    }
                 ],
             },
             "metadata": {"dependsOn": [health_check_name]},
@@ -225,28 +659,65 @@ EOF
                 "region": region,
                 "description": "Managed Instance Group for Darktrace vSensor.",
                 "target": getRef(MIG_NAME),
-                "autoscalingPolicy": {
-                    "minNumReplicas": min_size,
-                    "maxNumReplicas": max_size,
-                    "scaleDownControl": {
-                        "maxScaledDownReplicas": {"fixed": 1},
-                        "timeWindowSec": 600,
-                    },
-                    "coolDownPeriodSec": 300,
-                    "cpuUtilization": {
-                        "utilizationTarget": 0.75,
-                        "predictiveMethod": "OPTIMIZE_AVAILABILITY",
-                    },
-                },
+                "autoscalingPolicy": GenerateAutoscalingPolicy(gprop),
             },
         },
     ]
-    resources.extend(instance_templates)
+
+    if gprop["alerting-enable"]:
+        resources.extend(
+            GenerateAlertPolicies(project, name, MIG_NAME, BASE_NAME, gprop)
+        )
 
     outputs = [
         {"name": "mig-name", "value": MIG_NAME},
         {"name": "mig-ref", "value": getRef(MIG_NAME)},
         {"name": "mig-ig-ref", "value": getRef(MIG_NAME, "instanceGroup")},
+        {"name": "instance-template-name", "value": instance_template_name},
     ]
 
+    # Boot stage duration histograms, per stage and instance, from the startup script timing records.
+    # The first group creates this for the vSensors of every group (region and shard) of the deployment.
+    # https://cloud.google.com/logging/docs/reference/v2/rest/v2/projects.metrics
+    if boot_timing_enable and prop["boot-timing-metric"]:
+        resources.append(
+            {
+                "name": BOOT_TIMING_METRIC_NAME,
+                "type": "logging.v2.metric",
+                "properties": {
+                    "name": BOOT_TIMING_METRIC_NAME,
+                    "description": "Duration of each Darktrace vSensor startup stage, and time from boot to ready.",
+                    "filter": 'logName="projects/{}/logs/vsensor-boot-timing" AND jsonPayload.instance =~ "^{}(-[a-z]+-[a-z]+[0-9]+)?-vsensor-mig(-[0-9]+)?-vsensor-[a-z0-9]+$"'.format(
+                        project, deployment
+                    ),
+                    "metricDescriptor": {
+                        "metricKind": "DELTA",
+                        "valueType": "DISTRIBUTION",
+                        "unit": "s",
+                        "labels": [
+                            {"key": "stage", "valueType": "STRING"},
+                            {"key": "status", "valueType": "STRING"},
+                            {"key": "instance", "valueType": "STRING"},
+                        ],
+                    },
+                    "valueExtractor": "EXTRACT(jsonPayload.duration_sec)",
+                    "labelExtractors": {
+                        "stage": "EXTRACT(jsonPayload.stage)",
+                        "status": "EXTRACT(jsonPayload.status)",
+                        "instance": "EXTRACT(jsonPayload.instance)",
+                    },
+                    "bucketOptions": {
+                        "exponentialBuckets": {
+                            "numFiniteBuckets": 16,
+                            "growthFactor": 1.6,
+                            "scale": 1,
+                        }
+                    },
+                },
+            }
+        )
+        outputs.append(
+            {"name": "boot-timing-metric-name", "value": BOOT_TIMING_METRIC_NAME}
+        )
+
     return {"resources": resources, "outputs": outputs}
@@ -15,7 +15,7 @@
 
 """Creates a Bastion host for accessing the vSensors in the private subnet."""
 
-from common import getRef, prefixURLCompute
+from common import TemplateName, getRef, prefixURLCompute
 
 
 def GenerateConfig(context):
@@ -33,12 +33,8 @@ def GenerateConfig(context):
     external_cidr_ranges = [gprop["bastion-external-cidr"]]
     zone_1 = prefixURLCompute(context, "zones/" + gprop["zone1"])
     zone_2 = prefixURLCompute(context, "zones/" + gprop["zone2"])
-    username_sshkey = (
-        gprop["bastion-ssh-user-key"] if "bastion-ssh-user-key" in gprop else None
-    )
 
     INSTANCE_TEMPLATE_NAME = name + "-template"
-    INSTANCE_TEMPLATE_V2_NAME = INSTANCE_TEMPLATE_NAME + "-v2"
     SUBNET_NAME = name + "-subnet"
 
     # https://cloud.google.com/compute/docs/reference/rest/v1/instanceTemplates/insert
@@ -89,8 +85,8 @@ def GenerateConfig(context):
                         "items": [
                             {
                                 "key": "startup-script",
-                                # Do not adjust the indentation of the script contents! Instance templates are
-                                # immutable, so adjusting the whitespace will cause deployment updates to fail.
+                                # Do not adjust the indentation of the script contents! Instance templates are named after
+                                # their contents, so adjusting the whitespace will replace every instance.
                                 "value": """
                                 #! /bin/bash -xe
                                 exec > >(tee -a /var/log/user-data.log|logger -t user-data -s 2>/dev/console) 2>&1
@@ -105,28 +101,21 @@ def GenerateConfig(context):
             },
         }
 
-    instance_templates = [
-        make_template(
-            INSTANCE_TEMPLATE_V2_NAME,
+    def bastion_template(gprop):
+        instance_template = make_template(
+            INSTANCE_TEMPLATE_NAME,
             "projects/ubuntu-os-cloud/global/images/family/ubuntu-minimal-2404-lts-amd64",
         )
-    ]
-
-    # We need to keep this around during Focal->Noble upgrade because instance templates are immutable.
-    # Effectively we make a new template, then switch the MIG to use the new one, then in a separate update remove the old one.
-    if gprop.get("vsensor-63-upgrade-in-progress", False):
-        instance_templates.append(
-            make_template(
-                INSTANCE_TEMPLATE_NAME,
-                "projects/ubuntu-os-cloud/global/images/family/ubuntu-2004-lts",
-            )
-        )
-
-    for instance_template in instance_templates:
-        if username_sshkey:
+        if "bastion-ssh-user-key" in gprop:
             instance_template["properties"]["properties"]["metadata"]["items"].append(
-                {"key": "ssh-keys", "value": username_sshkey}
+                {"key": "ssh-keys", "value": gprop["bastion-ssh-user-key"]}
             )
+        # Instance templates are immutable, so name the template after its body (see autoscaledgroup.py).
+        instance_template["name"] = TemplateName(INSTANCE_TEMPLATE_NAME, instance_template)
+        return instance_template
+
+    instance_template = bastion_template(gprop)
+    instance_template_name = instance_template["name"]
 
     resources = [
         {
@@ -184,7 +173,8 @@ def GenerateConfig(context):
                             "serviceAccount:$(ref.{}.email)".format(service_account_id)
                         ],
                     },
-                ]
+                ],
+                "parallelism": gprop["iam-binding-parallelism"],
             },
         },
         {
@@ -197,12 +187,17 @@ def GenerateConfig(context):
                 "region": region,
                 "targetSize": 1,
                 "baseInstanceName": name + "-vm",
-                "instanceTemplate": getRef(INSTANCE_TEMPLATE_V2_NAME),
+                "instanceTemplate": getRef(instance_template_name),
                 "updatePolicy": {"type": "PROACTIVE"},
             },
         },
     ]
-    resources.extend(instance_templates)
+    resources.append(instance_template)
+    # Keep the previous template until a later update, as for the vSensors (see autoscaledgroup.py).
+    if "previous-global" in prop:
+        previous_template = bastion_template(prop["previous-global"])
+        if previous_template["name"] != instance_template_name:
+            resources.append(previous_template)
 
     outputs = [
         {"name": "subnet-ref", "value": getRef(SUBNET_NAME)},
@@ -0,0 +1,167 @@
+# Copyright 2022 Darktrace Holdings Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Recommends the vSensor machine type and Managed Instance Group size bounds
+for an expected amount of mirrored traffic.
+
+The output is a block of launch.yaml properties. The expected-* properties let
+the launch template warn if mig-max-size is later lowered below the peak.
+
+Usage:
+    python capacity_planner.py --peak-gbps 4 --baseline-gbps 1 [--peak-flows-per-sec 30000]
+"""
+
+import argparse
+import sys
+
+from common import (
+    GVNIC_ONLY_FAMILIES,
+    VSENSOR_CAPACITY_TARGET,
+    VSENSOR_MACHINE_CAPACITY,
+    MachineFamily,
+    RequiredVSensorCount,
+)
+
+# Prefer the smallest machine type that covers the peak with at most this many vSensors.
+# Smaller vSensors waste less outside of peaks, larger ones need fewer to scale out for spikes.
+PREFERRED_MAX_VSENSORS = 10
+# launch.py.schema limit of mig-max-size.
+MAX_VSENSORS = 100
+
+
+def plan(
+    peak_gbps,
+    baseline_gbps=0,
+    peak_flows_per_sec=0,
+    baseline_flows_per_sec=0,
+    ossensors=0,
+    machine_type=None,
+    cpu_target=VSENSOR_CAPACITY_TARGET,
+):
+    """Returns (machine type, min size, max size) for the expected traffic."""
+    machine_types = (
+        [machine_type]
+        if machine_type
+        else sorted(
+            VSENSOR_MACHINE_CAPACITY, key=lambda t: VSENSOR_MACHINE_CAPACITY[t]["gbps"]
+        )
+    )
+
+    def sizes(candidate):
+        # osSensors stay connected outside of peaks, so count towards both bounds.
+        min_size = RequiredVSensorCount(
+            candidate, baseline_gbps, baseline_flows_per_sec, ossensors, cpu_target
+        )
+        max_size = RequiredVSensorCount(
+            candidate, peak_gbps, peak_flows_per_sec, ossensors, cpu_target
+        )
+        return min_size, max(min_size, max_size)
+
+    for candidate in machine_types:
+        min_size, max_size = sizes(candidate)
+        if max_size <= PREFERRED_MAX_VSENSORS:
+            return candidate, min_size, max_size
+
+    # Nothing covers the peak with few vSensors, use the largest type.
+    min_size, max_size = sizes(machine_types[-1])
+    return machine_types[-1], min(min_size, MAX_VSENSORS), min(max_size, MAX_VSENSORS)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Recommend vSensor machine type and scaling bounds for expected mirrored traffic."
+    )
+    parser.add_argument(
+        "--peak-gbps", type=float, required=True, help="Peak mirrored throughput."
+    )
+    parser.add_argument(
+        "--baseline-gbps",
+        type=float,
+        default=0,
+        help="Baseline (ie out of hours) mirrored throughput.",
+    )
+    parser.add_argument(
+        "--peak-flows-per-sec", type=float, default=0, help="Peak new flows per second."
+    )
+    parser.add_argument(
+        "--baseline-flows-per-sec",
+        type=float,
+        default=0,
+        help="Baseline new flows per second.",
+    )
+    parser.add_argument(
+        "--ossensors", type=int, default=0, help="Number of osSensors connecting."
+    )
+    parser.add_argument(
+        "--machine-type",
+        choices=sorted(VSENSOR_MACHINE_CAPACITY),
+        help="Only size for this machine type.",
+    )
+    parser.add_argument(
+        "--cpu-target",
+        type=float,
+        default=VSENSOR_CAPACITY_TARGET,
+        help="mig-autoscale-cpu-target the vSensors will autoscale on (0 if CPU autoscaling is off).",
+    )
+    args = parser.parse_args(argv)
+
+    machine_type, min_size, max_size = plan(
+        args.peak_gbps,
+        args.baseline_gbps,
+        args.peak_flows_per_sec,
+        args.baseline_flows_per_sec,
+        args.ossensors,
+        args.machine_type,
+        args.cpu_target,
+    )
+    capacity = VSENSOR_MACHINE_CAPACITY[machine_type]
+
+    lines = [
+        "# Capacity plan: {:g} Gbps peak / {:g} Gbps baseline, {} osSensors.".format(
+            args.peak_gbps, args.baseline_gbps, args.ossensors
+        ),
+        "# {} ingests around {} Gbps / {} flows/s per vSensor.".format(
+            machine_type, capacity["gbps"], capacity["flows-per-sec"]
+        ),
+        "mig-instance-type: {}".format(machine_type),
+        "mig-min-size: {}".format(min_size),
+        "mig-max-size: {}".format(max_size),
+        "expected-peak-gbps: {:g}".format(args.peak_gbps),
+    ]
+    if args.cpu_target != VSENSOR_CAPACITY_TARGET:
+        lines.append("mig-autoscale-cpu-target: {:g}".format(args.cpu_target))
+    if MachineFamily(machine_type) in GVNIC_ONLY_FAMILIES:
+        lines.insert(3, "mig-nic-type: GVNIC")
+    if args.peak_flows_per_sec:
+        lines.append("expected-peak-flows-per-sec: {:g}".format(args.peak_flows_per_sec))
+    if args.ossensors:
+        lines.append("expected-ossensor-count: {}".format(args.ossensors))
+    if RequiredVSensorCount(
+        machine_type,
+        args.peak_gbps,
+        args.peak_flows_per_sec,
+        args.ossensors,
+        args.cpu_target,
+    ) > max_size:
+        lines.insert(
+            0,
+            "# WARNING: the peak needs more than {} vSensors, consider splitting mirrored subnets across deployments.".format(
+                MAX_VSENSORS
+            ),
+        )
+    sys.stdout.write("\n".join(lines) + "\n")
+
+
+if __name__ == "__main__":
+    main()
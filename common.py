@@ -15,50 +15,125 @@
 
 """Shared functions and long static code blocks used by the GCP Quick Start."""
 
+import hashlib
 import ipaddress
+import json
+import math
 
 # URL constants
 COMPUTE_URL_BASE = "https://www.googleapis.com/compute/v1/"
 
+# Packet mirroring filter defaults (all traffic) and per policy limits.
+# https://cloud.google.com/vpc/docs/packet-mirroring#specifications
+MIRROR_ALL_CIDR_RANGES = ["0.0.0.0/0", "::/0"]
+MIRROR_PROTOCOLS = ["tcp", "udp", "icmp", "esp", "ah", "ipip", "sctp"]
+MIRROR_DIRECTIONS = ["INGRESS", "EGRESS", "BOTH"]
+MIRROR_MAX_CIDR_RANGES = 30
+MIRROR_MAX_SUBNETS = 5
+MIRROR_MAX_TAGS = 5
+MIRROR_MAX_INSTANCES = 50
+
+# Longest name of a Compute Engine (and most other GCP) resource.
+GCP_NAME_MAX_LENGTH = 63
+
+# Tunable health check settings and the healthCheck fields they set, GCP defaults otherwise.
+# https://cloud.google.com/compute/docs/reference/rest/v1/healthChecks
+HEALTHCHECK_SETTINGS = {
+    "check-interval-sec": "checkIntervalSec",
+    "timeout-sec": "timeoutSec",
+    "healthy-threshold": "healthyThreshold",
+    "unhealthy-threshold": "unhealthyThreshold",
+}
+HEALTHCHECK_DEFAULT_INTERVAL_SEC = 5
+
+# Approximate sustained ingest of a single vSensor by machine type, for capacity planning.
+VSENSOR_MACHINE_CAPACITY = {
+    "e2-standard-2": {"gbps": 0.5, "flows-per-sec": 5000, "ossensors": 50},
+    "e2-standard-4": {"gbps": 1, "flows-per-sec": 10000, "ossensors": 100},
+    "e2-standard-8": {"gbps": 2, "flows-per-sec": 20000, "ossensors": 200},
+    "n2-standard-8": {"gbps": 3, "flows-per-sec": 30000, "ossensors": 250},
+    "n2-standard-16": {"gbps": 5, "flows-per-sec": 50000, "ossensors": 400},
+    "n2-standard-32": {"gbps": 8, "flows-per-sec": 80000, "ossensors": 600},
+    "n2d-standard-8": {"gbps": 3, "flows-per-sec": 30000, "ossensors": 250},
+    "n2d-standard-16": {"gbps": 5, "flows-per-sec": 50000, "ossensors": 400},
+    "n2d-standard-32": {"gbps": 9, "flows-per-sec": 90000, "ossensors": 600},
+    "c2-standard-8": {"gbps": 3.5, "flows-per-sec": 35000, "ossensors": 250},
+    "c2-standard-16": {"gbps": 6, "flows-per-sec": 60000, "ossensors": 400},
+    "c2-standard-30": {"gbps": 10, "flows-per-sec": 100000, "ossensors": 600},
+    "c3-standard-8": {"gbps": 4, "flows-per-sec": 40000, "ossensors": 250},
+    "c3-standard-22": {"gbps": 9, "flows-per-sec": 90000, "ossensors": 500},
+    "c3-standard-44": {"gbps": 15, "flows-per-sec": 150000, "ossensors": 800},
+    "c3d-standard-8": {"gbps": 4, "flows-per-sec": 40000, "ossensors": 250},
+    "c3d-standard-16": {"gbps": 7, "flows-per-sec": 70000, "ossensors": 400},
+    "c3d-standard-30": {"gbps": 11, "flows-per-sec": 110000, "ossensors": 600},
+    "c3d-standard-60": {"gbps": 18, "flows-per-sec": 180000, "ossensors": 1000},
+}
+
+# Machine families where Tier_1 networking is available, and the minimum vCPUs needed for it.
+# https://cloud.google.com/compute/docs/networking/configure-vm-with-high-bandwidth-configuration
+TIER_1_MIN_VCPUS = {"n2": 32, "n2d": 48, "c2": 30, "c3": 44, "c3d": 60}
+# Machine families which only support the gVNIC network interface.
+GVNIC_ONLY_FAMILIES = ["c3", "c3d"]
+# Machine families of the available vSensor types supporting Hyperdisk Balanced boot disks.
+HYPERDISK_FAMILIES = ["c3", "c3d"]
+# Machine families of the available vSensor types supporting local SSDs (c3/c3d only as -lssd types).
+LOCAL_SSD_FAMILIES = ["n2", "n2d", "c2"]
+# Numbers of local SSDs each of those vSensor types can attach, by its vCPUs.
+# https://cloud.google.com/compute/docs/disks/local-ssd#lssd_disk_options
+LOCAL_SSD_COUNTS = {
+    "n2-standard-8": [1, 2, 4, 8, 16, 24],
+    "n2-standard-16": [2, 4, 8, 16, 24],
+    "n2-standard-32": [4, 8, 16, 24],
+    "n2d-standard-8": [1, 2, 4, 8, 16, 24],
+    "n2d-standard-16": [1, 2, 4, 8, 16, 24],
+    "n2d-standard-32": [2, 4, 8, 16, 24],
+    "c2-standard-8": [1, 2, 4, 8],
+    "c2-standard-16": [2, 4, 8],
+    "c2-standard-30": [4, 8],
+}
+# Where the vSensor package keeps captured PCAPs before upload, local SSDs are mounted over it
+# once installed (checked by the startup script).
+VSENSOR_PCAP_PATH = "/var/lib/darktrace/pcaps"
+# Plan for vSensors to run at this fraction of their capacity without a configured CPU target.
+VSENSOR_CAPACITY_TARGET = 0.75
+
+# Log files shipped to Cloud Logging by the Ops Agent, by receiver.
+GCP_CLOUD_OPS_LOG_RECEIVERS = {
+    "vsensor-syslog": ["/var/log/messages", "/var/log/syslog"],
+    "vsensor-updates": [
+        "/var/log/darktrace-apt-dist-upgrade.log",
+        "/var/log/dpkg.log",
+        "/var/log/apt/term.log",
+        "/var/log/apt/history.log",
+    ],
+    "vsensor-services": [
+        "/var/log/sabreserver/*",
+        "/var/log/rs-tunnels/*.log",
+        "/var/log/nginx/access.log",
+        "/var/opt/bro/spool/manager/stdout.log",
+        "/var/opt/bro/spool/manager/stderr.log",
+        "/var/opt/bro/spool/tmp/*/.crash-diag.out",
+        "/var/log/chronicle/*.log",
+        "/var/log/darktrace-*",
+        "/var/log/inithooks.log",
+        "/var/log/heka/*",
+        "/var/log/redis/*",
+    ],
+    "vsensor-userdata": ["/var/log/user-data.log"],
+}
+# High volume access logs, split out of vsensor-services into their own receiver and
+# pipeline when disabled or sampled.
+GCP_CLOUD_OPS_ACCESS_LOG_RECEIVER = "vsensor-access"
+GCP_CLOUD_OPS_ACCESS_LOGS = ["/var/log/nginx/access.log"]
+
+# PCAP bucket storage classes, from hot to cold, and their minimum storage durations (days)
+# before deletion without early deletion charges.
+# https://cloud.google.com/storage/docs/storage-classes
+PCAP_STORAGE_CLASSES = ["STANDARD", "NEARLINE", "COLDLINE", "ARCHIVE"]
+PCAP_STORAGE_CLASS_MIN_DAYS = {"NEARLINE": 30, "COLDLINE": 90, "ARCHIVE": 365}
+
 # autopep8: off
-GCP_CLOUD_OPS_TEMPLATE = """
-logging:
-    receivers:
-        vsensor-syslog:
-            type: files
-            include_paths:
-                - /var/log/messages
-                - /var/log/syslog
-        vsensor-updates:
-            type: files
-            include_paths:
-                - /var/log/darktrace-apt-dist-upgrade.log
-                - /var/log/dpkg.log
-                - /var/log/apt/term.log
-                - /var/log/apt/history.log
-        vsensor-services:
-            type: files
-            include_paths:
-                - /var/log/sabreserver/*
-                - /var/log/rs-tunnels/*.log
-                - /var/log/nginx/access.log
-                - /var/opt/bro/spool/manager/stdout.log
-                - /var/opt/bro/spool/manager/stderr.log
-                - /var/opt/bro/spool/tmp/*/.crash-diag.out
-                - /var/log/chronicle/*.log
-                - /var/log/darktrace-*
-                - /var/log/inithooks.log
-                - /var/log/heka/*
-                - /var/log/redis/*
-        vsensor-userdata:
-            type: files
-            include_paths:
-                - /var/log/user-data.log
-    service:
-        pipelines:
-            default_pipeline:
-                receivers: [vsensor-syslog,vsensor-updates,vsensor-services,vsensor-userdata]
-metrics:
+GCP_CLOUD_OPS_METRICS = """metrics:
     receivers:
         hostmetrics:
             type: hostmetrics
@@ -73,9 +148,262 @@ metrics:
                 receivers: [hostmetrics]
                 processors: [metrics_filter]
 """
+
+# Log file of structured (JSON) timing records, one per vSensor startup script stage.
+GCP_CLOUD_OPS_BOOT_TIMING_LOG = "/var/log/vsensor-boot-timing.log"
+
+# Startup script functions to time each stage. `boot_stage NAME` ends the current stage
+# (if any) and starts the next, `boot_stage_end STATUS` ends the last stage and records
+# the time from instance boot to the end of the script as the `time-to-ready` stage.
+VSENSOR_BOOT_TIMING_SCRIPT = """
+BOOT_TIMING_LOG={log}
+BOOT_TIMING_INSTANCE=$(curl -sf -H "Metadata-Flavor: Google" http://metadata.google.internal/computeMetadata/v1/instance/name || hostname)
+boot_stage_name=""
+boot_stage_start=""
+function boot_stage_record() {{
+  printf '{{"stage": "%s", "duration_sec": %s, "status": "%s", "instance": "%s"}}\\n' "$1" "$2" "$3" "$BOOT_TIMING_INSTANCE" >> "$BOOT_TIMING_LOG"
+}}
+function boot_stage() {{
+  local now
+  now=$(date +%s.%N)
+  if [ -n "$boot_stage_name" ]; then
+    boot_stage_record "$boot_stage_name" "$(awk "BEGIN {{print $now - $boot_stage_start}}")" ok
+  fi
+  boot_stage_name="$1"
+  boot_stage_start="$now"
+}}
+function boot_stage_end() {{
+  local now
+  now=$(date +%s.%N)
+  boot_stage_record "$boot_stage_name" "$(awk "BEGIN {{print $now - $boot_stage_start}}")" "$1"
+  boot_stage_record time-to-ready "$(cut -d' ' -f1 /proc/uptime)" "$1"
+  boot_stage_name=""
+}}
+function boot_timing_exittrap() {{
+  exitcode="$?"
+  set +e
+  if [ -n "$boot_stage_name" ]; then
+    boot_stage_end failed
+  fi
+  (exit "$exitcode")
+  exittrap
+}}
+trap boot_timing_exittrap EXIT""".format(log=GCP_CLOUD_OPS_BOOT_TIMING_LOG)
 # autopep8: on
 
 
+def GenerateCloudOpsConfig(boot_timing=False, logging_options=None):
+    """Ops Agent configuration, optionally parsing the vSensor boot timing records.
+
+    logging_options (the ops-agent-logging property) can disable receivers, exclude log
+    lines matching regexes and sample the nginx access logs. Ops Agent has no sampling
+    processor, so access logs are sampled by only keeping those logged in the first
+    access-log-sample-percent of every 10 seconds."""
+    options = logging_options or {}
+    disabled_receivers = options.get("disabled-receivers", [])
+    exclude_patterns = options.get("exclude-patterns", [])
+    access_log_sample_percent = options.get("access-log-sample-percent", 100)
+
+    receivers = dict(GCP_CLOUD_OPS_LOG_RECEIVERS)
+    access_logs_split = (
+        access_log_sample_percent < 100
+        or GCP_CLOUD_OPS_ACCESS_LOG_RECEIVER in disabled_receivers
+    )
+    if access_logs_split:
+        receivers["vsensor-services"] = [
+            path
+            for path in receivers["vsensor-services"]
+            if path not in GCP_CLOUD_OPS_ACCESS_LOGS
+        ]
+        receivers[GCP_CLOUD_OPS_ACCESS_LOG_RECEIVER] = GCP_CLOUD_OPS_ACCESS_LOGS
+    if boot_timing:
+        receivers["vsensor-boot-timing"] = [GCP_CLOUD_OPS_BOOT_TIMING_LOG]
+
+    processors = {}
+    default_processors = []
+    if exclude_patterns:
+        # Each pattern is a string literal of the Ops Agent filter (escaping \\ and "), in a YAML
+        # single quoted string (escaping ').
+        processors["vsensor-exclude"] = [
+            "type: exclude_logs",
+            "match_any:",
+        ] + [
+            "    - 'jsonPayload.message =~ \"{}\"'".format(
+                pattern.replace("\\", "\\\\").replace('"', '\\"').replace("'", "''")
+            )
+            for pattern in exclude_patterns
+        ]
+        default_processors.append("vsensor-exclude")
+    access_processors = list(default_processors)
+    if access_log_sample_percent < 100:
+        # Exclude by the last digit of the seconds of the nginx [$time_local] timestamp.
+        processors["vsensor-access-sample"] = [
+            "type: exclude_logs",
+            "match_any:",
+            "    - 'jsonPayload.message =~ \":[0-5][{}-9] [+-]\"'".format(
+                access_log_sample_percent // 10
+            ),
+        ]
+        access_processors.append("vsensor-access-sample")
+    if boot_timing:
+        processors["vsensor-boot-timing-parser"] = ["type: parse_json"]
+
+    # [(name, receivers, processors)]
+    pipelines = []
+    default_receivers = [
+        receiver
+        for receiver in GCP_CLOUD_OPS_LOG_RECEIVERS
+        if receiver not in disabled_receivers
+    ]
+    # Always override the Ops Agent's built-in default_pipeline, which would otherwise ship syslog.
+    pipelines.append(("default_pipeline", default_receivers, default_processors))
+    if access_logs_split and GCP_CLOUD_OPS_ACCESS_LOG_RECEIVER not in disabled_receivers:
+        pipelines.append(
+            ("access_pipeline", [GCP_CLOUD_OPS_ACCESS_LOG_RECEIVER], access_processors)
+        )
+    if boot_timing:
+        pipelines.append(
+            (
+                "boot_timing_pipeline",
+                ["vsensor-boot-timing"],
+                ["vsensor-boot-timing-parser"],
+            )
+        )
+
+    lines = ["", "logging:"]
+    enabled_receivers = [
+        receiver for receiver in receivers if receiver not in disabled_receivers
+    ]
+    if enabled_receivers:
+        lines.append("    receivers:")
+    for receiver in enabled_receivers:
+        paths = receivers[receiver]
+        lines.extend(
+            ["        {}:".format(receiver), "            type: files", "            include_paths:"]
+            + ["                - " + path for path in paths]
+        )
+    if processors:
+        lines.append("    processors:")
+        for processor, config in processors.items():
+            lines.append("        {}:".format(processor))
+            lines.extend("            " + line for line in config)
+    lines.extend(["    service:", "        pipelines:"])
+    for pipeline, pipeline_receivers, pipeline_processors in pipelines:
+        lines.extend(
+            [
+                "            {}:".format(pipeline),
+                "                receivers: [{}]".format(",".join(pipeline_receivers)),
+            ]
+        )
+        if pipeline_processors:
+            lines.append(
+                "                processors: [{}]".format(",".join(pipeline_processors))
+            )
+    return "\n".join(lines) + "\n" + GCP_CLOUD_OPS_METRICS
+
+
+def FixedOrPercent(value):
+    """Converts a count such as 2 or a percentage such as '10%' to a GCP FixedOrPercent."""
+    value = str(value).strip()
+    if value.endswith("%"):
+        return {"percent": int(value[:-1])}
+    return {"fixed": int(value)}
+
+
+def MirroredSubnets(subnets_to_mirror):
+    """Normalises the subnets-to-mirror property, either a comma-separated string of subnet
+    names or a list of subnet names and/or filter specs, into a list of filter specs."""
+    if isinstance(subnets_to_mirror, str):
+        subnets_to_mirror = [
+            subnet for subnet in subnets_to_mirror.split(",") if subnet.strip()
+        ]
+
+    specs = []
+    for subnet in subnets_to_mirror:
+        if isinstance(subnet, str):
+            subnet = {"name": subnet}
+        specs.append(
+            {
+                "name": subnet.get("name", "").strip(),
+                "cidr-ranges": subnet.get("cidr-ranges", MIRROR_ALL_CIDR_RANGES),
+                "protocols": subnet.get("protocols", []),
+                "direction": subnet.get("direction", "BOTH"),
+                "shard": subnet.get("shard"),
+            }
+        )
+    return specs
+
+
+def PackMirroredSubnets(specs, prefix):
+    """Packs subnet filter specs with the same filter into as few policies as the per policy
+    subnet limit allows, returning [(policy name, [specs])]. Policies are named after their
+    filter and filled in list order, so appending subnets does not change existing policies."""
+    groups = {}
+    for spec in specs:
+        key = "{}|{}|{}".format(
+            ",".join(sorted(spec["cidr-ranges"])),
+            ",".join(sorted(spec["protocols"])),
+            spec["direction"],
+        )
+        groups.setdefault(key, []).append(spec)
+
+    policies = []
+    for key, group in groups.items():
+        # Ignore poor cryptography, not used for security
+        filter_hash = hashlib.md5(key.encode("utf-8")).hexdigest()[:6]  # nosemgrep
+        for index in range(0, len(group), MIRROR_MAX_SUBNETS):
+            policies.append(
+                (
+                    "mirror-{}-{}-{}".format(
+                        prefix, filter_hash, index // MIRROR_MAX_SUBNETS
+                    ),
+                    group[index : index + MIRROR_MAX_SUBNETS],
+                )
+            )
+    return policies
+
+
+def CollectorShard(source, shards, shard=None):
+    """The collector shard mirroring a source (subnet, tag or instance), unless given explicitly.
+    Hashing the source name keeps existing sources on their shard as further sources are added."""
+    if shard is not None:
+        return shard
+    # Ignore poor cryptography, not used for security
+    return int(hashlib.md5(source.encode("utf-8")).hexdigest(), 16) % shards  # nosemgrep
+
+
+def TemplateName(prefix, instance_template):
+    """Names an instance template after a hash of its body. Instance templates are immutable,
+    so any change to the body makes a new template for the MIG to roll over to."""
+    body = json.dumps(instance_template["properties"], sort_keys=True)
+    # Ignore poor cryptography, not used for security
+    return "{}-{}".format(prefix, hashlib.md5(body.encode("utf-8")).hexdigest()[:8])  # nosemgrep
+
+
+def MachineFamily(machine_type):
+    """e2-standard-4 -> e2"""
+    return machine_type.split("-", 1)[0]
+
+
+def MachineVCPUs(machine_type):
+    """e2-standard-4 -> 4"""
+    return int(machine_type.rsplit("-", 1)[1])
+
+
+def RequiredVSensorCount(
+    machine_type, gbps, flows_per_sec=0, ossensors=0, cpu_target=VSENSOR_CAPACITY_TARGET
+):
+    """Number of vSensors of a machine type needed to ingest the given load at the
+    autoscaler CPU target (fraction of capacity, 0 if CPU autoscaling is off)."""
+    capacity = VSENSOR_MACHINE_CAPACITY[machine_type]
+    load = max(
+        gbps / capacity["gbps"],
+        flows_per_sec / capacity["flows-per-sec"],
+        ossensors / capacity["ossensors"],
+    )
+    return max(1, int(math.ceil(load / (cpu_target or VSENSOR_CAPACITY_TARGET))))
+
+
 def getRef(resource, output="selfLink"):
     return "$(ref.{}.{})".format(resource, output)
 
@@ -109,6 +437,22 @@ def RegionComputeLink(project, collection, name, region):
     )
 
 
+def ZoneComputeLink(project, collection, name, zone):
+    return "".join(
+        [
+            COMPUTE_URL_BASE,
+            "projects/",
+            project,
+            "/zones/",
+            zone,
+            "/",
+            collection,
+            "/",
+            name,
+        ]
+    )
+
+
 def GenerateOSSensorLBIP(cidr_range):
     # We will be giving it the range of the vSensor subnet, the MIG starts from lowest IP first,
     # so should be good to pick the last IP in the cidr.
@@ -0,0 +1,202 @@
+# Copyright 2022 Darktrace Holdings Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Predicts how long a deployment takes to create from its resource dependencies.
+
+Deployment Manager creates resources concurrently, except where a resource has
+to wait for another through metadata.dependsOn or a $(ref.X.Y) reference. The
+dependency graph of a rendered manifest (see render.py) is combined with an
+estimated creation time per resource type to find the critical path, the
+predicted wall-clock time and the waves of resources created concurrently.
+
+Usage:
+    python critical_path.py --config launch.yaml [--max-seconds <SECONDS>]
+"""
+
+import argparse
+import os
+import sys
+
+from render import REF_PATTERN, load_config, render
+
+# Rough creation times (seconds) observed per resource type.
+RESOURCE_LATENCY_SECS = {
+    "compute.v1.network": 30,
+    "compute.v1.subnetwork": 20,
+    "compute.v1.firewall": 15,
+    "compute.v1.address": 10,
+    "compute.v1.router": 25,
+    "compute.v1.routes": 15,
+    "compute.v1.healthCheck": 15,
+    "compute.v1.instanceTemplate": 10,
+    "compute.v1.regionInstanceGroupManager": 60,
+    "compute.beta.regionInstanceGroupManager": 60,
+    "compute.v1.regionAutoscaler": 20,
+    "compute.v1.regionBackendService": 30,
+    "compute.v1.forwardingRule": 30,
+    "gcp-types/compute-v1:packetMirrorings": 30,
+    "iam.v1.serviceAccount": 10,
+    "gcp-types/iam-v1:projects.roles": 10,
+    "storage.v1.bucket": 10,
+    "gcp-types/monitoring-v1:projects.dashboards": 5,
+}
+# Virtual IAM binding types read-modify-write the whole IAM policy.
+IAM_BINDING_LATENCY_SECS = 20
+DEFAULT_LATENCY_SECS = 20
+
+
+def resource_latency(resource_type, latencies=None):
+    latencies = latencies or RESOURCE_LATENCY_SECS
+    if resource_type in latencies:
+        return latencies[resource_type]
+    if resource_type.endswith("iamMemberBinding"):
+        return IAM_BINDING_LATENCY_SECS
+    return DEFAULT_LATENCY_SECS
+
+
+def build_graph(manifest):
+    """Returns {resource name: set of resource names it must wait for}."""
+    names = set(r["name"] for r in manifest["resources"])
+    graph = {}
+    for resource in manifest["resources"]:
+        dependencies = set(resource.get("metadata", {}).get("dependsOn", []))
+        dependencies.update(
+            ref_name
+            for ref_name, _ in REF_PATTERN.findall(str(resource.get("properties", {})))
+        )
+        dependencies.discard(resource["name"])
+        # References to resources outside of the deployment (ie existing VPCs) don't wait.
+        graph[resource["name"]] = dependencies & names
+    return graph
+
+
+def analyze(manifest, latencies=None):
+    """Computes the critical path and predicted creation time of a manifest."""
+    graph = build_graph(manifest)
+    types = {r["name"]: r["type"] for r in manifest["resources"]}
+
+    # Kahn's algorithm, keeping the manifest order between independent resources.
+    order = []
+    remaining = dict((name, set(dependencies)) for name, dependencies in graph.items())
+    while remaining:
+        ready = [name for name, dependencies in remaining.items() if not dependencies]
+        if not ready:
+            raise Exception(
+                "Circular dependencies between resources: "
+                + ", ".join(sorted(remaining))
+            )
+        for name in ready:
+            del remaining[name]
+            order.append(name)
+        for dependencies in remaining.values():
+            dependencies.difference_update(ready)
+
+    finish = {}
+    wave = {}
+    previous = {}
+    for name in order:
+        start = 0
+        wave[name] = 0
+        previous[name] = None
+        for dependency in graph[name]:
+            wave[name] = max(wave[name], wave[dependency] + 1)
+            if finish[dependency] > start:
+                start = finish[dependency]
+                previous[name] = dependency
+        finish[name] = start + resource_latency(types[name], latencies)
+
+    critical_path = []
+    name = max(order, key=lambda n: finish[n]) if order else None
+    while name:
+        critical_path.insert(0, name)
+        name = previous[name]
+
+    waves = []
+    for name in order:
+        while len(waves) <= wave[name]:
+            waves.append([])
+        waves[wave[name]].append(name)
+
+    return {
+        "predicted-secs": max(finish.values()) if finish else 0,
+        "serial-secs": sum(resource_latency(types[n], latencies) for n in order),
+        "critical-path": [
+            {"name": n, "type": types[n], "finish-secs": finish[n]}
+            for n in critical_path
+        ],
+        "waves": waves,
+    }
+
+
+def format_report(analysis):
+    lines = [
+        "Predicted creation time: {}s (fully serial: {}s)".format(
+            analysis["predicted-secs"], analysis["serial-secs"]
+        ),
+        "",
+        "Critical path:",
+    ]
+    for step in analysis["critical-path"]:
+        lines.append(
+            "  {:>5}s  {} ({})".format(step["finish-secs"], step["name"], step["type"])
+        )
+    lines.extend(["", "Creation waves (resources in a wave are created concurrently):"])
+    for index, names in enumerate(analysis["waves"]):
+        lines.append("  {}: {}".format(index, ", ".join(names)))
+    return "\n".join(lines) + "\n"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Report the critical path and predicted creation time of a deployment."
+    )
+    parser.add_argument("--config", default="launch.yaml", help="Configuration file.")
+    parser.add_argument(
+        "--manifest", help="Analyze an already rendered manifest instead of --config."
+    )
+    parser.add_argument(
+        "--deployment", default="vsensor-quickstart", help="Deployment name."
+    )
+    parser.add_argument("--project", default="my-project", help="GCP project ID.")
+    parser.add_argument(
+        "--max-seconds",
+        type=int,
+        help="Exit with an error if the predicted creation time is longer than this.",
+    )
+    args = parser.parse_args(argv)
+
+    if args.manifest:
+        manifest = load_config(args.manifest)
+    else:
+        manifest = render(
+            load_config(args.config),
+            args.deployment,
+            args.project,
+            os.path.dirname(os.path.abspath(args.config)),
+        )
+
+    analysis = analyze(manifest)
+    sys.stdout.write(format_report(analysis))
+
+    if args.max_seconds is not None and analysis["predicted-secs"] > args.max_seconds:
+        sys.stderr.write(
+            "Predicted creation time {}s exceeds the limit of {}s\n".format(
+                analysis["predicted-secs"], args.max_seconds
+            )
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+# Copyright 2022 Darktrace Holdings Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Creates a Cloud Monitoring dashboard of vSensor fleet performance: vSensor
+load, Managed Instance Group size against its bounds, collector traffic and
+boot time."""
+
+from common import getRef
+
+# Dashboard tiles are laid out in two columns of this width (of 12).
+TILE_WIDTH = 6
+TILE_HEIGHT = 4
+
+
+def GenerateChart(title, data_sets, thresholds=None, y_label=None):
+    chart = {"dataSets": data_sets, "timeshiftDuration": "0s"}
+    if thresholds:
+        chart["thresholds"] = thresholds
+    if y_label:
+        chart["yAxis"] = {"label": y_label, "scale": "LINEAR"}
+    return {"title": title, "xyChart": chart}
+
+
+def GenerateDataSet(
+    metric_filter, aligner, reducer=None, group_by=None, legend=None, plot="LINE"
+):
+    aggregation = {"alignmentPeriod": "60s", "perSeriesAligner": aligner}
+    if reducer:
+        aggregation["crossSeriesReducer"] = reducer
+        aggregation["groupByFields"] = group_by or []
+    data_set = {
+        "plotType": plot,
+        "timeSeriesQuery": {
+            "timeSeriesFilter": {"filter": metric_filter, "aggregation": aggregation}
+        },
+    }
+    if legend:
+        data_set["legendTemplate"] = legend
+    return data_set
+
+
+def GenerateConfig(context):
+    """Generates YAML resource configuration."""
+
+    name = context.env["name"]
+    project = context.env["project"]
+    deployment = context.env["deployment"]
+    prop = context.properties
+    gprop = prop["global"]
+
+    # Refs to resource names are not resolved inside arrays, so generate the names
+    # autoscaledgroup.py and loadbalancer.py give the MIGs, vSensors and collectors.
+    mig_template_names = prop["mig-template-names"]
+    ingest_template_names = prop["ingest-template-names"]
+    mig_names = [mig + "-group" for mig in mig_template_names]
+    instance_prefixes = [mig + "-vsensor" for mig in mig_template_names]
+    collector_names = [
+        ingest + "-packet-mirror-collector" for ingest in ingest_template_names
+    ]
+    boot_timing_enable = gprop["mig-boot-timing-enable"]
+
+    def one_of(field, values):
+        return "{} = one_of({})".format(
+            field, ", ".join('"{}"'.format(value) for value in values)
+        )
+
+    vsensors = 'resource.type = "gce_instance" AND ({})'.format(
+        " OR ".join(
+            'metadata.system_labels.name = starts_with("{}")'.format(prefix)
+            for prefix in instance_prefixes
+        )
+    )
+    by_instance = "${resource.labels.instance_id}"
+
+    widgets = [
+        GenerateChart(
+            "vSensor CPU utilization",
+            [
+                GenerateDataSet(
+                    'metric.type = "compute.googleapis.com/instance/cpu/utilization" AND '
+                    + vsensors,
+                    "ALIGN_MEAN",
+                    legend=by_instance,
+                )
+            ],
+            thresholds=[
+                {
+                    "label": "Autoscale target",
+                    "value": gprop["mig-autoscale-cpu-target"],
+                }
+            ]
+            if gprop["mig-autoscale-cpu-target"] > 0
+            else None,
+        ),
+        GenerateChart(
+            "vSensor NIC receive rate",
+            [
+                GenerateDataSet(
+                    'metric.type = "compute.googleapis.com/instance/network/received_bytes_count" AND '
+                    + vsensors,
+                    "ALIGN_RATE",
+                    legend=by_instance,
+                )
+            ],
+            y_label="bytes/s",
+        ),
+        GenerateChart(
+            "vSensor NIC receive errors and drops",
+            [
+                GenerateDataSet(
+                    'metric.type = "agent.googleapis.com/interface/errors" AND metric.labels.direction = "rx" AND '
+                    + vsensors,
+                    "ALIGN_RATE",
+                    "REDUCE_SUM",
+                    ["resource.labels.instance_id"],
+                    legend=by_instance,
+                )
+            ],
+            y_label="errors/s",
+        ),
+        # Drops are reported by the mirrored source instances, which belong to the mirrored
+        # subnets/tags rather than this deployment, so the tile covers the whole project.
+        GenerateChart(
+            "Packet mirroring drops (all mirrored sources in the project)",
+            [
+                GenerateDataSet(
+                    'metric.type = "compute.googleapis.com/mirroring/dropped_packets_count" AND resource.type = "gce_instance"',
+                    "ALIGN_RATE",
+                    "REDUCE_SUM",
+                    [],
+                    legend="Dropped packets/s (project)",
+                )
+            ],
+        ),
+        GenerateChart(
+            "vSensor Managed Instance Group size",
+            [
+                GenerateDataSet(
+                    'metric.type = "compute.googleapis.com/instance_group/size" AND resource.type = "instance_group" AND '
+                    + one_of("resource.labels.instance_group_name", mig_names),
+                    "ALIGN_MAX",
+                    legend="${resource.labels.instance_group_name}",
+                )
+            ],
+            thresholds=[
+                {"label": "mig-max-size", "value": gprop["mig-max-size"]},
+                {"label": "mig-min-size", "value": gprop["mig-min-size"]},
+            ],
+        ),
+        GenerateChart(
+            "Collector load balancer traffic",
+            [
+                GenerateDataSet(
+                    'metric.type = "loadbalancing.googleapis.com/l3/internal/ingress_bytes_count" AND resource.type = "internal_tcp_lb_rule" AND '
+                    + one_of("resource.labels.forwarding_rule_name", collector_names),
+                    "ALIGN_RATE",
+                    "REDUCE_SUM",
+                    ["resource.labels.forwarding_rule_name"],
+                    legend="${resource.labels.forwarding_rule_name}",
+                )
+            ],
+            y_label="bytes/s",
+        ),
+    ]
+    if boot_timing_enable:
+        # The boot timing metric of the main vSensor group covers the vSensors of every group.
+        boot_timing_metric_name = mig_template_names[0] + "-boot-stage-duration"
+        widgets.append(
+            GenerateChart(
+                "vSensor time to ready (p50 / p95)",
+                [
+                    GenerateDataSet(
+                        'metric.type = "logging.googleapis.com/user/{}" AND metric.labels.stage = "time-to-ready"'.format(
+                            boot_timing_metric_name
+                        ),
+                        aligner,
+                        legend=legend,
+                    )
+                    for aligner, legend in [
+                        ("ALIGN_PERCENTILE_50", "p50"),
+                        ("ALIGN_PERCENTILE_95", "p95"),
+                    ]
+                ],
+                y_label="s",
+            )
+        )
+
+    tiles = [
+        {
+            "xPos": (index % 2) * TILE_WIDTH,
+            "yPos": (index // 2) * TILE_HEIGHT,
+            "width": TILE_WIDTH,
+            "height": TILE_HEIGHT,
+            "widget": widget,
+        }
+        for index, widget in enumerate(widgets)
+    ]
+
+    resources = [
+        {
+            "name": name,
+            "type": "gcp-types/monitoring-v1:projects.dashboards",
+            "properties": {
+                "parent": "projects/" + project,
+                "displayName": "Darktrace vSensors ({})".format(deployment),
+                "mosaicLayout": {"columns": 2 * TILE_WIDTH, "tiles": tiles},
+            },
+        }
+    ]
+    outputs = [{"name": "dashboard-name", "value": getRef(name, "name")}]
+
+    return {"resources": resources, "outputs": outputs}
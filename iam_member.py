@@ -71,8 +71,19 @@ def generate_config(context):
         dependson = {}
         dependson_root = []
 
+    # Every binding read-modify-writes the IAM policy of the one target resource.
+    # Each binding waits for the previous one in its lane, with `parallelism` lanes
+    # (default 1, one binding at a time) writing the policy concurrently. The
+    # iamMemberBinding types re-read the policy and retry when a concurrent write
+    # changes its etag, so more lanes trade retries for a shorter deployment.
+    parallelism = max(1, properties.get("parallelism", 1))
+    lanes = [dependson] * parallelism
+    binding_count = 0
+
     for role in properties["roles"]:
         for member in role["members"]:
+            lane = binding_count % parallelism
+            binding_count += 1
             # Ignore poor cryptography, not used for security
             # nosemgrep
             suffix = sha1(
@@ -91,9 +102,11 @@ def generate_config(context):
                     "member": member,
                 },
             }
-            iam_resource.update(dependson)
+            iam_resource.update(lanes[lane])
             resources.append(iam_resource)
 
-            dependson = {"metadata": {"dependsOn": [resource_name] + dependson_root}}
+            lanes[lane] = {
+                "metadata": {"dependsOn": [resource_name] + dependson_root}
+            }
 
     return {"resources": resources}
@@ -19,18 +19,165 @@ vSensors into a GCP project."""
 # https://cloud.google.com/deployment-manager/docs/configuration/supported-resource-types
 
 import hashlib
-from common import getRef
+import ipaddress
+import re
+from common import (
+    getRef,
+    CollectorShard,
+    MachineFamily,
+    MachineVCPUs,
+    RequiredVSensorCount,
+    MirroredSubnets,
+    PCAP_STORAGE_CLASSES,
+    PCAP_STORAGE_CLASS_MIN_DAYS,
+    GCP_CLOUD_OPS_ACCESS_LOG_RECEIVER,
+    GCP_CLOUD_OPS_LOG_RECEIVERS,
+    GCP_NAME_MAX_LENGTH,
+    GVNIC_ONLY_FAMILIES,
+    HEALTHCHECK_DEFAULT_INTERVAL_SEC,
+    HEALTHCHECK_SETTINGS,
+    HYPERDISK_FAMILIES,
+    LOCAL_SSD_COUNTS,
+    LOCAL_SSD_FAMILIES,
+    TIER_1_MIN_VCPUS,
+    MIRROR_DIRECTIONS,
+    MIRROR_MAX_CIDR_RANGES,
+    MIRROR_MAX_INSTANCES,
+    MIRROR_MAX_SUBNETS,
+    MIRROR_MAX_TAGS,
+    MIRROR_PROTOCOLS,
+)
+
+
+def mirror_filter_errors(spec):
+    """Validates the filter of a subnets-to-mirror spec."""
+    errors = []
+    for cidr_range in spec["cidr-ranges"]:
+        try:
+            ipaddress.ip_network(cidr_range)
+        except ValueError:
+            errors.append(
+                "Mirrored subnet {} filter CIDR range {} is not valid.".format(
+                    spec["name"], cidr_range
+                )
+            )
+    if len(spec["cidr-ranges"]) > MIRROR_MAX_CIDR_RANGES:
+        errors.append(
+            "Mirrored subnet {} filter has more than {} CIDR ranges.".format(
+                spec["name"], MIRROR_MAX_CIDR_RANGES
+            )
+        )
+    if not set(spec["protocols"]) <= set(MIRROR_PROTOCOLS):
+        errors.append(
+            "Mirrored subnet {} filter protocols must be from: {}.".format(
+                spec["name"], ", ".join(MIRROR_PROTOCOLS)
+            )
+        )
+    if spec["direction"] not in MIRROR_DIRECTIONS:
+        errors.append(
+            "Mirrored subnet {} filter direction must be one of: {}.".format(
+                spec["name"], ", ".join(MIRROR_DIRECTIONS)
+            )
+        )
+    return errors
+
+
+def RegionProperties(prop, region_block):
+    """Launch properties of one of the additional-regions, its own zones, subnet, mirrored
+    sources and (optionally) sizing, otherwise the same as the main region."""
+    region_prop = dict(prop)
+    # Mirrored sources are regional, so are never inherited from the main region.
+    region_prop.update(
+        {"subnets-to-mirror": "", "mirrored-tags": [], "mirrored-instances": []}
+    )
+    region_prop.update(region_block)
+    region_prop["region"] = region_prop["zone1"].rsplit("-", 1)[0]
+    region_prop["additional-regions"] = []
+    return region_prop
+
+
+def HealthCheckProperties(settings, log=False):
+    """HTTPS health check of the vSensor /healthcheck endpoint, with any HEALTHCHECK_SETTINGS given."""
+    health_check = {
+        "httpsHealthCheck": {"port": 443, "requestPath": "/healthcheck"},
+        "type": "HTTPS",
+    }
+    for setting, field in HEALTHCHECK_SETTINGS.items():
+        if setting in settings:
+            health_check[field] = settings[setting]
+    if log:
+        health_check["logConfig"] = {"enable": True}
+    return health_check
+
+
+def LongestNameSuffix(prop):
+    """Length of the longest resource name the templates generate, less the deployment name. The
+    names of every region and collector shard group follow the conventions of GenerateConfig below,
+    autoscaledgroup.py, loadbalancer.py and network.py."""
+    # Hashes of instance templates (common.TemplateName) and packed mirroring policies
+    # (common.PackMirroredSubnets), and the random suffix of MIG instance names.
+    template_hash = "-" + "0" * 8
+    filter_hash = "-" + "0" * 6
+    instance_suffix = "-" + "0" * 4
+    names = [
+        "-net-firewall-packet-mirror-ipv4",
+        "-bastion-template" + template_hash,
+        "-bastion-firewall-internal",
+        "-autohealing-healthcheck",
+    ]
+    if prop["mig-boot-timing-enable"]:
+        names.append("-vsensor-mig-boot-stage-duration")
+    groups = [("", prop)] + [
+        ("-" + region_prop["region"], region_prop)
+        for region_prop in (
+            RegionProperties(prop, region_block)
+            for region_block in prop["additional-regions"]
+        )
+    ]
+    for region_part, gprop in groups:
+        names.append(region_part + "-net-vsensor-subnet-router")
+        subnets = MirroredSubnets(gprop["subnets-to-mirror"])
+        packed_index = str(max(0, len(subnets) - 1) // MIRROR_MAX_SUBNETS)
+        for shard_index in range(gprop["collector-shards"]):
+            shard_part = "-{}".format(shard_index) if shard_index else ""
+            mig = region_part + "-vsensor-mig" + shard_part
+            ingest = region_part + "-ingestion" + shard_part
+            names.extend(
+                [
+                    mig + "-template" + template_hash,
+                    mig + "-vsensor" + instance_suffix,
+                    mig + "-autoscale",
+                    ingest + "-lb-ossensor",
+                    ingest + "-packet-mirror-collector",
+                    # Mirroring policies are named mirror-<INGEST>-...
+                    "mirror-" + ingest + "-targets",
+                ]
+            )
+            if gprop["mirror-policy-packing"]:
+                names.append("mirror-" + ingest + filter_hash + "-" + packed_index)
+            if gprop["alerting-enable"]:
+                names.append(mig + "-alert-nic-errors")
+    return max(len(name) for name in names)
 
 
 def validation(context):
+    """Raises an exception for invalid configuration, returns a list of warnings."""
     name = context.env["deployment"]
     prop = context.properties
 
     errors = []
+    warnings = []
     if len(name) > 40:
         errors.append(
             "Deployment name is too long. Choose a name 40 characters or less."
         )
+    name_max_length = GCP_NAME_MAX_LENGTH - LongestNameSuffix(prop)
+    if len(name) > name_max_length:
+        errors.append(
+            "Deployment name is too long for the resource names of this configuration (its regions, collector shards and options). Choose a name {} characters or less.".format(
+                name_max_length
+            )
+        )
     if prop["mig-min-size"] > prop["mig-max-size"]:
         errors.append(
             "vSensor Managed Instance Group size minimum is larger than the maximum."
@@ -50,17 +197,416 @@ def validation(context):
         errors.append(
             "Providing existing subnets to be packet mirrored requires an existing VPC (existing-vpc-name)"
         )
+    if (prop["mirrored-tags"] or prop["mirrored-instances"]) and not (
+        "existing-vpc-name" in prop and len(prop["existing-vpc-name"]) > 0
+    ):
+        errors.append(
+            "Providing tags/instances to be packet mirrored requires an existing VPC (existing-vpc-name)"
+        )
+    if len(prop["mirrored-tags"]) > MIRROR_MAX_TAGS:
+        errors.append(
+            "At most {} mirrored-tags can be packet mirrored.".format(MIRROR_MAX_TAGS)
+        )
+    if len(prop["mirrored-instances"]) > MIRROR_MAX_INSTANCES:
+        errors.append(
+            "At most {} mirrored-instances can be packet mirrored.".format(
+                MIRROR_MAX_INSTANCES
+            )
+        )
+    for instance in prop["mirrored-instances"]:
+        if instance.split("/", 1)[0].rsplit("-", 1)[0] != prop["zone1"].rsplit("-", 1)[0]:
+            errors.append(
+                "Mirrored instance {} must be given as ZONE/INSTANCE_NAME, in the same region as the vSensors.".format(
+                    instance
+                )
+            )
+    if prop["mig-autoscale-cpu-target"] == 0 and not (
+        "mig-autoscale-received-bytes-per-sec" in prop
+        or "mig-autoscale-received-packets-per-sec" in prop
+        or prop["mig-autoscale-custom-metrics"]
+    ):
+        errors.append(
+            "The vSensor autoscaler needs a signal: set mig-autoscale-cpu-target above 0 or provide an ingest/custom metric target."
+        )
+    if (
+        prop["mig-autoscale-cpu-target"] == 0
+        and prop["mig-autoscale-predictive"] != "NONE"
+    ):
+        errors.append(
+            "Predictive autoscaling (mig-autoscale-predictive) requires CPU autoscaling (mig-autoscale-cpu-target above 0)."
+        )
+    for custom_metric in prop["mig-autoscale-custom-metrics"]:
+        if "metric" not in custom_metric or custom_metric.get("target", 0) <= 0:
+            errors.append(
+                "Each mig-autoscale-custom-metrics entry requires a metric and a target above 0."
+            )
+    scale_in_max = str(prop["mig-autoscale-scale-in-max-replicas"])
+    if not re.match(r"^[0-9]+%?$", scale_in_max) or (
+        scale_in_max.endswith("%") and int(scale_in_max[:-1]) > 100
+    ):
+        errors.append(
+            "mig-autoscale-scale-in-max-replicas must be a number of instances or a percentage up to 100%."
+        )
+    for update_property in [
+        "mig-update-max-surge",
+        "mig-update-max-unavailable",
+        "mig-update-canary-size",
+    ]:
+        if update_property not in prop:
+            continue
+        value = str(prop[update_property])
+        if not re.match(r"^[0-9]+%?$", value) or (
+            value.endswith("%") and int(value[:-1]) > 100
+        ):
+            errors.append(
+                "{} must be a number of instances or a percentage up to 100%.".format(
+                    update_property
+                )
+            )
+        elif update_property != "mig-update-canary-size" and value == "1":
+            # Fixed values of regional groups must be 0 or at least the number of zones.
+            errors.append(
+                "{} must be 0 or at least 2, the number of zones.".format(update_property)
+            )
+    if str(prop.get("mig-update-max-unavailable", "")).rstrip("%") == "0" and str(
+        prop.get("mig-update-max-surge", "0")
+    ).rstrip("%") == "0":
+        errors.append(
+            "mig-update-max-surge must be above 0 when mig-update-max-unavailable is 0, to be able to replace vSensors."
+        )
+    if "mig-update-canary-size" in prop and "mig-previous-template" not in prop:
+        errors.append(
+            "mig-update-canary-size requires mig-previous-template, the instance template the other vSensors stay on."
+        )
+    healthcheck_settings = {
+        setting: prop["healthcheck-" + setting]
+        for setting in HEALTHCHECK_SETTINGS
+        if "healthcheck-" + setting in prop
+    }
+    for check, settings in [
+        ("healthcheck", healthcheck_settings),
+        (
+            "autohealing-healthcheck",
+            dict(healthcheck_settings, **prop["autohealing-healthcheck"]),
+        ),
+    ]:
+        if settings.get("timeout-sec", 0) > settings.get(
+            "check-interval-sec", HEALTHCHECK_DEFAULT_INTERVAL_SEC
+        ):
+            errors.append(
+                "{} timeout-sec must not be longer than its check-interval-sec.".format(
+                    check
+                )
+            )
+    tracking = prop["lb-connection-tracking"]
+    if tracking.get("tracking-mode") == "PER_SESSION" and prop.get(
+        "lb-session-affinity"
+    ) not in ["CLIENT_IP", "CLIENT_IP_PROTO"]:
+        errors.append(
+            "lb-connection-tracking tracking-mode PER_SESSION requires lb-session-affinity CLIENT_IP or CLIENT_IP_PROTO."
+        )
+    if "idle-timeout-sec" in tracking and (
+        tracking.get("tracking-mode") != "PER_SESSION"
+        or tracking["idle-timeout-sec"] < 600
+    ):
+        errors.append(
+            "lb-connection-tracking idle-timeout-sec must be at least 600, and requires tracking-mode PER_SESSION (with lb-session-affinity CLIENT_IP or CLIENT_IP_PROTO)."
+        )
+    if (
+        tracking.get("persistence-on-unhealthy-backends") == "ALWAYS_PERSIST"
+        and tracking.get("tracking-mode") == "PER_SESSION"
+    ):
+        errors.append(
+            "lb-connection-tracking persistence-on-unhealthy-backends ALWAYS_PERSIST requires tracking-mode PER_CONNECTION."
+        )
+    schedule_names = [schedule.get("name") for schedule in prop["scaling-schedules"]]
+    if len(set(schedule_names)) != len(schedule_names):
+        errors.append("Each scaling-schedules entry must have a unique name.")
+    for schedule in prop["scaling-schedules"]:
+        if len(str(schedule.get("schedule", "")).split()) != 5:
+            errors.append(
+                "Scaling schedule {} requires a five field cron expression (schedule).".format(
+                    schedule.get("name")
+                )
+            )
+        min_replicas = schedule.get("min-replicas", 0)
+        if not prop["mig-min-size"] < min_replicas <= prop["mig-max-size"]:
+            errors.append(
+                "Scaling schedule {} min-replicas must be above mig-min-size and no more than mig-max-size.".format(
+                    schedule.get("name")
+                )
+            )
+    shard_sources = [0] * prop["collector-shards"]
+    if prop["bastion-enable"]:
+        shard_sources[0] += 1
+    for source in prop["mirrored-tags"] + prop["mirrored-instances"]:
+        shard_sources[CollectorShard(source, prop["collector-shards"])] += 1
+    for spec in MirroredSubnets(prop["subnets-to-mirror"]):
+        if not spec["name"]:
+            errors.append("Each subnets-to-mirror entry requires a subnet name.")
+            continue
+        if spec["shard"] is not None and not (
+            isinstance(spec["shard"], int)
+            and 0 <= spec["shard"] < prop["collector-shards"]
+        ):
+            errors.append(
+                "Mirrored subnet {} shard must be from 0 to collector-shards - 1.".format(
+                    spec["name"]
+                )
+            )
+        else:
+            shard_sources[
+                CollectorShard(spec["name"], prop["collector-shards"], spec["shard"])
+            ] += 1
+        errors.extend(mirror_filter_errors(spec))
+        if (
+            not prop["mirror-policy-packing"]
+            and len("mirror-" + spec["name"]) > GCP_NAME_MAX_LENGTH
+        ):
+            errors.append(
+                "Mirrored subnet {} name is too long for its packet mirroring policy (mirror-<SUBNET>), use mirror-policy-packing.".format(
+                    spec["name"]
+                )
+            )
+    if prop["collector-shards"] > 1 and 0 in shard_sources:
+        warnings.append(
+            "Collector shards {} have no mirrored sources, so only idle at mig-min-size.".format(
+                ", ".join(str(i) for i, count in enumerate(shard_sources) if count == 0)
+            )
+        )
+    if prop["alerting-enable"] and not prop["alert-notification-channels"]:
+        warnings.append(
+            "Alerting policies have no alert-notification-channels, so alerts are only shown in the console."
+        )
+    transitions = prop["pcap-storage-class-transitions"]
+    if transitions and prop["pcap-storage-autoclass"]:
+        errors.append(
+            "pcap-storage-class-transitions cannot be used with pcap-storage-autoclass, which manages storage classes itself."
+        )
+    previous_transition = {"storage-class": "STANDARD", "age-days": 0}
+    for transition in transitions:
+        if transition["age-days"] >= prop["pcap-retention-time-days"]:
+            errors.append(
+                "PCAP storage class transition to {} after {} days is not within pcap-retention-time-days.".format(
+                    transition["storage-class"], transition["age-days"]
+                )
+            )
+        elif (
+            prop["pcap-retention-time-days"] - transition["age-days"]
+            < PCAP_STORAGE_CLASS_MIN_DAYS[transition["storage-class"]]
+        ):
+            warnings.append(
+                "PCAPs are deleted before their minimum {} storage duration of {} days, so incur early deletion charges.".format(
+                    transition["storage-class"],
+                    PCAP_STORAGE_CLASS_MIN_DAYS[transition["storage-class"]],
+                )
+            )
+        if PCAP_STORAGE_CLASSES.index(
+            transition["storage-class"]
+        ) <= PCAP_STORAGE_CLASSES.index(previous_transition["storage-class"]) or (
+            transition["age-days"] <= previous_transition["age-days"]
+        ):
+            errors.append(
+                "pcap-storage-class-transitions must move to colder storage classes at increasing ages."
+            )
+        previous_transition = transition
+    ops_agent_logging = prop["ops-agent-logging"]
+    log_receivers = list(GCP_CLOUD_OPS_LOG_RECEIVERS) + [GCP_CLOUD_OPS_ACCESS_LOG_RECEIVER]
+    if not set(ops_agent_logging.get("disabled-receivers", [])) <= set(log_receivers):
+        errors.append(
+            "ops-agent-logging disabled-receivers must be from: {}.".format(
+                ", ".join(log_receivers)
+            )
+        )
+    if ops_agent_logging.get("access-log-sample-percent", 100) % 10 != 0:
+        errors.append(
+            "ops-agent-logging access-log-sample-percent must be a multiple of 10."
+        )
+    machine_family = MachineFamily(prop["mig-instance-type"])
+    if machine_family in GVNIC_ONLY_FAMILIES and prop["mig-nic-type"] != "GVNIC":
+        errors.append(
+            "{} instance types require the gVNIC network interface (mig-nic-type: GVNIC).".format(
+                machine_family
+            )
+        )
+    if prop["mig-tier1-networking"]:
+        if prop["mig-nic-type"] != "GVNIC":
+            errors.append(
+                "Tier_1 networking requires the gVNIC network interface (mig-nic-type: GVNIC)."
+            )
+        if MachineVCPUs(prop["mig-instance-type"]) < TIER_1_MIN_VCPUS.get(
+            machine_family, float("inf")
+        ):
+            errors.append(
+                "Tier_1 networking is not available for {} vSensors.".format(
+                    prop["mig-instance-type"]
+                )
+            )
+    if (
+        prop["mig-disk-type"] == "hyperdisk-balanced"
+        and machine_family not in HYPERDISK_FAMILIES
+    ):
+        errors.append(
+            "hyperdisk-balanced boot disks are only available for {} vSensors.".format(
+                "/".join(HYPERDISK_FAMILIES)
+            )
+        )
+    if machine_family in HYPERDISK_FAMILIES and prop["mig-disk-type"] == "pd-standard":
+        errors.append(
+            "pd-standard boot disks are not available for {} vSensors.".format(
+                machine_family
+            )
+        )
+    if prop["mig-disk-type"] != "hyperdisk-balanced" and (
+        "mig-disk-provisioned-iops" in prop or "mig-disk-provisioned-throughput" in prop
+    ):
+        errors.append(
+            "mig-disk-provisioned-iops/-throughput are only available for hyperdisk-balanced boot disks."
+        )
+    if prop["mig-local-ssd-count"] and machine_family not in LOCAL_SSD_FAMILIES:
+        errors.append(
+            "Local SSDs are only available for {} vSensors.".format(
+                "/".join(LOCAL_SSD_FAMILIES)
+            )
+        )
+    elif (
+        prop["mig-local-ssd-count"]
+        and prop["mig-local-ssd-count"] not in LOCAL_SSD_COUNTS[prop["mig-instance-type"]]
+    ):
+        errors.append(
+            "{} vSensors can only have {} local SSDs (mig-local-ssd-count).".format(
+                prop["mig-instance-type"],
+                "/".join(str(count) for count in LOCAL_SSD_COUNTS[prop["mig-instance-type"]]),
+            )
+        )
+    if prop["mig-local-ssd-count"] and (
+        prop["mig-standby-stopped-size"] or prop["mig-standby-suspended-size"]
+    ):
+        errors.append(
+            "vSensors with local SSDs cannot be kept in a standby pool (mig-standby-stopped-size/-suspended-size)."
+        )
+    if machine_family == "e2" and (
+        "mig-min-cpu-platform" in prop or "mig-threads-per-core" in prop
+    ):
+        errors.append(
+            "e2 instance types do not support mig-min-cpu-platform or mig-threads-per-core."
+        )
+    if "expected-peak-gbps" in prop:
+        required_size = RequiredVSensorCount(
+            prop["mig-instance-type"],
+            prop["expected-peak-gbps"],
+            prop.get("expected-peak-flows-per-sec", 0),
+            prop.get("expected-ossensor-count", 0),
+            prop["mig-autoscale-cpu-target"],
+        )
+        if required_size > prop["mig-max-size"]:
+            warnings.append(
+                "mig-max-size {} cannot cover the expected peak traffic, which needs around {} {} vSensors.".format(
+                    prop["mig-max-size"], required_size, prop["mig-instance-type"]
+                )
+            )
+    regions = [prop["zone1"].rsplit("-", 1)[0]]
+    # Mirroring policies are named after the subnet, so names must be unique across regions.
+    mirrored_subnet_names = [
+        spec["name"] for spec in MirroredSubnets(prop["subnets-to-mirror"])
+    ]
+    subnet_cidrs = [prop["mig-subnet-cidr"]]
+    if prop["bastion-enable"] and "bastion-subnet-cidr" in prop:
+        subnet_cidrs.append(prop["bastion-subnet-cidr"])
+    for region_block in prop["additional-regions"]:
+        region_prop = RegionProperties(prop, region_block)
+        region = region_prop["region"]
+        if region_prop["zone2"].rsplit("-", 1)[0] != region:
+            errors.append(
+                "Additional region zones {} and {} are not within the same region.".format(
+                    region_prop["zone1"], region_prop["zone2"]
+                )
+            )
+        if region in regions:
+            errors.append(
+                "Region {} is deployed more than once, each region needs a single block.".format(
+                    region
+                )
+            )
+        regions.append(region)
+        if region_prop["mig-min-size"] > region_prop["mig-max-size"]:
+            errors.append(
+                "vSensor Managed Instance Group size minimum is larger than the maximum in {}.".format(
+                    region
+                )
+            )
+        for schedule in region_prop["scaling-schedules"]:
+            if not (
+                region_prop["mig-min-size"]
+                < schedule.get("min-replicas", 0)
+                <= region_prop["mig-max-size"]
+            ):
+                errors.append(
+                    "Scaling schedule {} min-replicas must be above mig-min-size and no more than mig-max-size in {}.".format(
+                        schedule.get("name"), region
+                    )
+                )
+        subnet_cidr = ipaddress.ip_network(region_prop["mig-subnet-cidr"], strict=False)
+        if any(
+            subnet_cidr.overlaps(ipaddress.ip_network(cidr, strict=False))
+            for cidr in subnet_cidrs
+        ):
+            errors.append(
+                "vSensor subnet {} in {} overlaps with another vSensor/bastion subnet.".format(
+                    region_prop["mig-subnet-cidr"], region
+                )
+            )
+        subnet_cidrs.append(region_prop["mig-subnet-cidr"])
+        if (
+            region_prop["subnets-to-mirror"]
+            or region_prop["mirrored-tags"]
+            or region_prop["mirrored-instances"]
+        ) and not ("existing-vpc-name" in prop and len(prop["existing-vpc-name"]) > 0):
+            errors.append(
+                "Packet mirroring in {} requires an existing VPC (existing-vpc-name)".format(
+                    region
+                )
+            )
+        for instance in region_prop["mirrored-instances"]:
+            if instance.split("/", 1)[0].rsplit("-", 1)[0] != region:
+                errors.append(
+                    "Mirrored instance {} must be given as ZONE/INSTANCE_NAME, in {}.".format(
+                        instance, region
+                    )
+                )
+        for spec in MirroredSubnets(region_prop["subnets-to-mirror"]):
+            if not spec["name"]:
+                errors.append("Each subnets-to-mirror entry requires a subnet name.")
+                continue
+            if spec["name"] in mirrored_subnet_names:
+                errors.append(
+                    "Mirrored subnet {} is given in more than one region.".format(
+                        spec["name"]
+                    )
+                )
+            mirrored_subnet_names.append(spec["name"])
+            errors.extend(mirror_filter_errors(spec))
+            if (
+                not region_prop["mirror-policy-packing"]
+                and len("mirror-" + spec["name"]) > GCP_NAME_MAX_LENGTH
+            ):
+                errors.append(
+                    "Mirrored subnet {} name is too long for its packet mirroring policy (mirror-<SUBNET>), use mirror-policy-packing.".format(
+                        spec["name"]
+                    )
+                )
     if errors:
         raise Exception(
             "The deployment configuration has not passed validation:\n    - "
             + "\n    - ".join(errors)
         )
+    return warnings
 
 
 def GenerateConfig(context):
     """Generate YAML resource configuration."""
 
-    validation(context)
+    warnings = validation(context)
 
     name = context.env["deployment"]
 
@@ -84,12 +630,121 @@ def GenerateConfig(context):
 
     pcap_storage_enable = prop["pcap-retention-time-days"] != 0
 
+    # The launch properties the previous vSensor instance templates were made with.
+    previous_prop = None
+    if "mig-previous-template" in prop:
+        previous_prop = dict(prop, **prop["mig-previous-template"].get("properties", {}))
+
     HEALTHCHECK_NAME = name + "-healthcheck"
+    AUTOHEALING_HEALTHCHECK_NAME = name + "-autohealing-healthcheck"
     NETWORK_TEMPLATE_NAME = name + "-net"
     MIG_TEMPLATE_NAME = name + "-vsensor-mig"
     BASTION_TEMPLATE_NAME = name + "-bastion"
     STORAGE_TEMPLATE_NAME = name + "-storage"
     INGEST_TEMPLATE_NAME = name + "-ingestion"
+    DASHBOARD_TEMPLATE_NAME = name + "-dashboard"
+
+    def mig_template(
+        mig_template_name,
+        network_template_name,
+        gprop,
+        previous_gprop=None,
+        first=True,
+    ):
+        template = {
+            "name": mig_template_name,
+            "type": "autoscaledgroup.py",
+            "properties": {
+                "vpc-ref": getRef(network_template_name, "vpc-ref"),
+                "subnet-ref": getRef(network_template_name, "subnet-ref"),
+                "healthcheck-name": autohealing_healthcheck_name,
+                "global": gprop,
+                "deployment-hash": deployment_hash,
+                "service-account-email": getRef(service_account_id, "email"),
+                "pcap-bucket-name": getRef(STORAGE_TEMPLATE_NAME, "bucket-name"),
+                # One boot timing metric covers the vSensors of every group.
+                "boot-timing-metric": first,
+            },
+        }
+        # Keep the previous instance template of the group through the rolling update. Only the
+        # name of the main group's template is output, so only that can be checked.
+        if previous_gprop is not None:
+            template["properties"]["previous-global"] = previous_gprop
+            if first:
+                template["properties"]["previous-template-name"] = prop[
+                    "mig-previous-template"
+                ]["name"]
+        # The first vSensor of the main MIG sets up the shared storage HMAC key, so further
+        # groups (and their first vSensors) are only created once the main MIG is.
+        if not first:
+            template["metadata"] = {"dependsOn": [MIG_TEMPLATE_NAME + "-group"]}
+        return template
+
+    def ingest_template(
+        ingest_template_name,
+        mig_template_name,
+        network_template_name,
+        gprop,
+        shard_index=0,
+        bastion_subnet_ref=None,
+    ):
+        return {
+            "name": ingest_template_name,
+            "type": "loadbalancer.py",
+            "properties": {
+                "vpc-ref": getRef(network_template_name, "vpc-ref"),
+                "mig-ig-ref": getRef(mig_template_name, "mig-ig-ref"),
+                "mig-subnet-ref": getRef(network_template_name, "subnet-ref"),
+                "bastion-subnet-ref": bastion_subnet_ref,
+                "healthcheck-name": HEALTHCHECK_NAME,
+                "shard-index": shard_index,
+                "global": gprop,
+            },
+        }
+
+    def further_shard_templates(
+        mig_template_name,
+        ingest_template_name,
+        network_template_name,
+        gprop,
+        previous_gprop=None,
+    ):
+        # Further collector shards each get their own MIG, autoscaler and load balancer.
+        # The bastion and osSensors are only served by the first.
+        templates = []
+        for shard_index in range(1, gprop["collector-shards"]):
+            templates.extend(
+                [
+                    mig_template(
+                        "{}-{}".format(mig_template_name, shard_index),
+                        network_template_name,
+                        gprop,
+                        previous_gprop,
+                        first=False,
+                    ),
+                    ingest_template(
+                        "{}-{}".format(ingest_template_name, shard_index),
+                        "{}-{}".format(mig_template_name, shard_index),
+                        network_template_name,
+                        gprop,
+                        shard_index,
+                    ),
+                ]
+            )
+        return templates
+
+    # The load balancer health check, which by default also autoheals the MIGs. A separate, more
+    # tolerant autohealing check lets the load balancer fail over quickly without recreating vSensors.
+    healthcheck_settings = {
+        setting: prop["healthcheck-" + setting]
+        for setting in HEALTHCHECK_SETTINGS
+        if "healthcheck-" + setting in prop
+    }
+    # Health check logs are needed to alert on unhealthy vSensors.
+    health_check = HealthCheckProperties(healthcheck_settings, prop["alerting-enable"])
+    autohealing_healthcheck_name = HEALTHCHECK_NAME
+    if prop["autohealing-healthcheck"]:
+        autohealing_healthcheck_name = AUTOHEALING_HEALTHCHECK_NAME
 
     resources = [
         # Setup the VPC and vSensor Subnet
@@ -126,33 +781,29 @@ def GenerateConfig(context):
                             "serviceAccount:$(ref.{}.email)".format(service_account_id)
                         ],
                     },
-                ]
+                ],
+                "parallelism": prop["iam-binding-parallelism"],
             },
         },
         # Generate an Autoscaling Managed Instance Group containing vSensors.
-        {
-            "name": MIG_TEMPLATE_NAME,
-            "type": "autoscaledgroup.py",
-            "properties": {
-                "vpc-ref": getRef(NETWORK_TEMPLATE_NAME, "vpc-ref"),
-                "subnet-ref": getRef(NETWORK_TEMPLATE_NAME, "subnet-ref"),
-                "healthcheck-name": HEALTHCHECK_NAME,
-                "global": prop,
-                "deployment-hash": deployment_hash,
-                "service-account-email": getRef(service_account_id, "email"),
-                "pcap-bucket-name": getRef(STORAGE_TEMPLATE_NAME, "bucket-name"),
-            },
-        },
+        mig_template(MIG_TEMPLATE_NAME, NETWORK_TEMPLATE_NAME, prop, previous_prop),
         # Health check used by load balancer and Instance Group.
         {
             "name": HEALTHCHECK_NAME,
             "type": "compute.v1.healthCheck",
-            "properties": {
-                "httpsHealthCheck": {"port": 443, "requestPath": "/healthcheck"},
-                "type": "HTTPS",
-            },
+            "properties": health_check,
         },
     ]
+    if prop["autohealing-healthcheck"]:
+        resources.append(
+            {
+                "name": AUTOHEALING_HEALTHCHECK_NAME,
+                "type": "compute.v1.healthCheck",
+                "properties": HealthCheckProperties(
+                    dict(healthcheck_settings, **prop["autohealing-healthcheck"])
+                ),
+            }
+        )
     if pcap_storage_enable:
         resources.extend(
             [
@@ -170,7 +821,8 @@ def GenerateConfig(context):
                                     )
                                 ],
                             }
-                        ]
+                        ],
+                        "parallelism": prop["iam-binding-parallelism"],
                     },
                 },
                 # Create a Storage Bucket to permanently store PCAPS across vSensor scaling
@@ -183,7 +835,8 @@ def GenerateConfig(context):
                         "service-account-email": getRef(service_account_id, "email"),
                         "deployment-hash": deployment_hash,
                     },
-                    "metadata": {"dependsOn": [MIG_TEMPLATE_NAME]},
+                    # No dependency on the MIG: its instance templates wait for the bucket instead,
+                    # so the bucket and IAM role are created alongside the network.
                 },
             ]
         )
@@ -201,23 +854,112 @@ def GenerateConfig(context):
                 },
             }
         )
+        if previous_prop is not None:
+            resources[-1]["properties"]["previous-global"] = previous_prop
         bastion_subnet_ref = getRef(BASTION_TEMPLATE_NAME, "subnet-ref")
 
+    # Configure a load balancer for osSensor and packet mirroring
     resources.append(
-        # Configure a load balancer for osSensor and packet mirroring
-        {
-            "name": INGEST_TEMPLATE_NAME,
-            "type": "loadbalancer.py",
-            "properties": {
-                "vpc-ref": getRef(NETWORK_TEMPLATE_NAME, "vpc-ref"),
-                "mig-ig-ref": getRef(MIG_TEMPLATE_NAME, "mig-ig-ref"),
-                "mig-subnet-ref": getRef(NETWORK_TEMPLATE_NAME, "subnet-ref"),
-                "bastion-subnet-ref": bastion_subnet_ref,
-                "healthcheck-name": HEALTHCHECK_NAME,
-                "global": prop,
-            },
-        }
+        ingest_template(
+            INGEST_TEMPLATE_NAME,
+            MIG_TEMPLATE_NAME,
+            NETWORK_TEMPLATE_NAME,
+            prop,
+            bastion_subnet_ref=bastion_subnet_ref,
+        )
     )
+    resources.extend(
+        further_shard_templates(
+            MIG_TEMPLATE_NAME,
+            INGEST_TEMPLATE_NAME,
+            NETWORK_TEMPLATE_NAME,
+            prop,
+            previous_prop,
+        )
+    )
+
+    # Packet mirroring is regional, so each further region gets its own vSensor subnet, MIG and
+    # load balancer in the same VPC. The service account, IAM bindings, health check and PCAP
+    # bucket are shared with the main region.
+    region_outputs = []
+    for region_block in prop["additional-regions"]:
+        region_prop = RegionProperties(prop, region_block)
+        region_previous_prop = (
+            RegionProperties(previous_prop, region_block) if previous_prop else None
+        )
+        region_name = name + "-" + region_prop["region"]
+        region_network_name = region_name + "-net"
+        region_mig_name = region_name + "-vsensor-mig"
+        region_ingest_name = region_name + "-ingestion"
+        resources.extend(
+            [
+                {
+                    "name": region_network_name,
+                    "type": "network.py",
+                    "properties": {
+                        "global": region_prop,
+                        "vpc-name": getRef(NETWORK_TEMPLATE_NAME, "vpc-name"),
+                        "vpc-ref": getRef(NETWORK_TEMPLATE_NAME, "vpc-ref"),
+                    },
+                },
+                mig_template(
+                    region_mig_name,
+                    region_network_name,
+                    region_prop,
+                    region_previous_prop,
+                    first=False,
+                ),
+                ingest_template(
+                    region_ingest_name, region_mig_name, region_network_name, region_prop
+                ),
+            ]
+        )
+        resources.extend(
+            further_shard_templates(
+                region_mig_name,
+                region_ingest_name,
+                region_network_name,
+                region_prop,
+                region_previous_prop,
+            )
+        )
+        region_outputs.extend(
+            [
+                {
+                    "name": "nat-external-ip-" + region_prop["region"],
+                    "value": getRef(region_network_name, "nat-ip"),
+                },
+                {
+                    "name": "vsensor-subnet-name-" + region_prop["region"],
+                    "value": getRef(region_network_name, "subnet-name"),
+                },
+            ]
+        )
+        if ossensor_lb_enable:
+            region_outputs.append(
+                {
+                    "name": "ossensor-vsensor-ip-" + region_prop["region"],
+                    "value": getRef(region_ingest_name, "ossensor-loadbalancer-ip"),
+                }
+            )
+
+    # Optionally monitor every vSensor group and collector of the deployment in one dashboard.
+    if prop["dashboard-enable"]:
+        resources.append(
+            {
+                "name": DASHBOARD_TEMPLATE_NAME,
+                "type": "dashboard.py",
+                "properties": {
+                    "global": prop,
+                    "mig-template-names": [
+                        r["name"] for r in resources if r["type"] == "autoscaledgroup.py"
+                    ],
+                    "ingest-template-names": [
+                        r["name"] for r in resources if r["type"] == "loadbalancer.py"
+                    ],
+                },
+            }
+        )
 
     outputs = [
         {"name": "vpc-name", "value": getRef(NETWORK_TEMPLATE_NAME, "vpc-name")},
@@ -226,6 +968,10 @@ def GenerateConfig(context):
             "name": "vsensor-subnet-name",
             "value": getRef(NETWORK_TEMPLATE_NAME, "subnet-name"),
         },
+        {
+            "name": "vsensor-instance-template-name",
+            "value": getRef(MIG_TEMPLATE_NAME, "instance-template-name"),
+        },
     ]
     if pcap_storage_enable:
         outputs.extend(
@@ -256,4 +1002,16 @@ def GenerateConfig(context):
             ]
         )
 
+    outputs.extend(region_outputs)
+    if prop["dashboard-enable"]:
+        outputs.append(
+            {
+                "name": "dashboard-name",
+                "value": getRef(DASHBOARD_TEMPLATE_NAME, "dashboard-name"),
+            }
+        )
+
+    if warnings:
+        outputs.append({"name": "validation-warnings", "value": warnings})
+
     return {"resources": resources, "outputs": outputs}
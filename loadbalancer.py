@@ -16,36 +16,101 @@
 """Creates a TCP load balancer backend with forwarding rules for optional
 Bastion, packet mirroring and osSensors."""
 
-from common import RegionComputeLink, getRef, GenerateOSSensorLBIP
+from common import (
+    CollectorShard,
+    RegionComputeLink,
+    ZoneComputeLink,
+    getRef,
+    GenerateOSSensorLBIP,
+    MirroredSubnets,
+    PackMirroredSubnets,
+    MIRROR_ALL_CIDR_RANGES,
+)
 
 
-def GenerateMirrorConfig(
-    project, region, vpc_ref, collector, subnet_name, subnet_ref=None
+def GenerateMirrorPolicy(
+    project,
+    region,
+    vpc_ref,
+    collector,
+    rule_name,
+    description,
+    mirrored_resources,
+    spec=None,
 ):
-    rule_name = "mirror-" + subnet_name
-    return [
-        {
+    # Mirror all traffic unless given a filter spec (see common.MirroredSubnets).
+    spec = spec or {}
+    return {
+        "name": rule_name,
+        "type": "gcp-types/compute-v1:packetMirrorings",
+        "properties": {
+            "description": description,
+            "network": {"url": vpc_ref},
             "name": rule_name,
-            "type": "gcp-types/compute-v1:packetMirrorings",
-            "properties": {
-                "description": "Packet mirroring policy for subnetwork: " + subnet_name,
-                "network": {"url": vpc_ref},
-                "name": rule_name,
-                "region": region,
-                "projectId": project,
-                "collectorIlb": {"url": getRef(collector)},
-                "mirroredResources": {
-                    "subnetworks": [
-                        {"url": subnet_ref if subnet_ref else getRef(subnet_name)}
-                    ]
-                },
-                "filter": {
-                    "cidrRanges": ["0.0.0.0/0", "::/0"],
-                    "IPProtocols": [],  # All
-                    "direction": "BOTH",
-                },
+            "region": region,
+            "projectId": project,
+            "collectorIlb": {"url": getRef(collector)},
+            "mirroredResources": mirrored_resources,
+            "filter": {
+                "cidrRanges": spec.get("cidr-ranges", MIRROR_ALL_CIDR_RANGES),
+                "IPProtocols": spec.get("protocols", []),  # Empty for all
+                "direction": spec.get("direction", "BOTH"),
             },
+        },
+    }
+
+
+def GenerateBackendOptions(gprop):
+    """Optional session affinity, connection tracking and failover settings of the backend service,
+    keeping each mirrored flow / osSensor session on one vSensor as the MIG scales."""
+    options = {}
+    if "lb-session-affinity" in gprop:
+        options["sessionAffinity"] = gprop["lb-session-affinity"]
+    tracking = gprop["lb-connection-tracking"]
+    if tracking:
+        options["connectionTrackingPolicy"] = {
+            field: tracking[setting]
+            for setting, field in [
+                ("tracking-mode", "trackingMode"),
+                (
+                    "persistence-on-unhealthy-backends",
+                    "connectionPersistenceOnUnhealthyBackends",
+                ),
+                ("idle-timeout-sec", "idleTimeoutSec"),
+            ]
+            if setting in tracking
+        }
+    failover = gprop["lb-failover"]
+    if failover:
+        options["failoverPolicy"] = {
+            field: failover[setting]
+            for setting, field in [
+                ("drop-traffic-if-unhealthy", "dropTrafficIfUnhealthy"),
+                (
+                    "disable-connection-drain-on-failover",
+                    "disableConnectionDrainOnFailover",
+                ),
+            ]
+            if setting in failover
         }
+    return options
+
+
+def GenerateMirrorConfig(
+    project, region, vpc_ref, collector, subnet_name, subnet_ref=None, spec=None
+):
+    rule_name = "mirror-" + subnet_name
+    return [
+        GenerateMirrorPolicy(
+            project,
+            region,
+            vpc_ref,
+            collector,
+            rule_name,
+            "Packet mirroring policy for subnetwork: " + subnet_name,
+            {"subnetworks": [{"url": subnet_ref if subnet_ref else getRef(subnet_name)}]},
+            spec,
+        )
     ]
 
 
@@ -63,11 +128,25 @@ def GenerateConfig(context):
     bastion_subnet_ref = prop["bastion-subnet-ref"]
     # new resource names cannot contain refs to objects, so we must generate this string manually.
     bastion_subnet_name = deployment + "-bastion-subnet"
-    mirrored_subnet_names = (
-        gprop["subnets-to-mirror"].split(",")
-        if len(gprop["subnets-to-mirror"]) > 0
-        else []
-    )
+    # Only mirror the sources partitioned to this collector shard.
+    shard_index = prop["shard-index"]
+    shards = gprop["collector-shards"]
+    mirrored_subnets = [
+        spec
+        for spec in MirroredSubnets(gprop["subnets-to-mirror"])
+        if CollectorShard(spec["name"], shards, spec["shard"]) == shard_index
+    ]
+    mirrored_tags = [
+        tag for tag in gprop["mirrored-tags"] if CollectorShard(tag, shards) == shard_index
+    ]
+    mirrored_instance_refs = []
+    for instance in gprop["mirrored-instances"]:
+        if CollectorShard(instance, shards) != shard_index:
+            continue
+        zone, instance_name = instance.split("/", 1)
+        mirrored_instance_refs.append(
+            ZoneComputeLink(project, "instances", instance_name, zone)
+        )
     ipv6 = gprop["ipv6-enable"]
     vpc_ref = prop["vpc-ref"]
     health_check_name = prop["healthcheck-name"]
@@ -77,11 +156,15 @@ def GenerateConfig(context):
     region = gprop["region"]
     mig_subnet_cidr = gprop["mig-subnet-cidr"]
 
-    enable_ossensor_lb = "ossensor-hmac" in gprop and gprop["ossensor-hmac"] != ""
+    # osSensors register via a fixed IP, so only the first shard serves them.
+    enable_ossensor_lb = (
+        "ossensor-hmac" in gprop and gprop["ossensor-hmac"] != "" and shard_index == 0
+    )
 
     BACKEND_NAME = name + "-lb-backend"
     FRONTEND_OSSENSOR_NAME = name + "-lb-ossensor"
     TRAFFIC_MIRROR_COLLECTOR_NAME = name + "-packet-mirror-collector"
+    TARGETS_MIRROR_NAME = "mirror-" + name + "-targets"
 
     resources = [
         {
@@ -95,6 +178,7 @@ def GenerateConfig(context):
                 "loadBalancingScheme": "INTERNAL",
                 "network": vpc_ref,
                 "connectionDraining": {"drainingTimeoutSec": 300},
+                **GenerateBackendOptions(gprop),
             },
             "metadata": {"dependsOn": [health_check_name]},
         },
@@ -150,15 +234,62 @@ def GenerateConfig(context):
         )
 
     # Add packet mirroring config for any further subnets to mirror.
-    for subnet_name in mirrored_subnet_names:
-        resources.extend(
-            GenerateMirrorConfig(
+    if gprop["mirror-policy-packing"]:
+        for rule_name, specs in PackMirroredSubnets(mirrored_subnets, name):
+            resources.append(
+                GenerateMirrorPolicy(
+                    project,
+                    region,
+                    vpc_ref,
+                    TRAFFIC_MIRROR_COLLECTOR_NAME,
+                    rule_name,
+                    "Packet mirroring policy for subnetworks: "
+                    + ", ".join(spec["name"] for spec in specs),
+                    {
+                        "subnetworks": [
+                            {
+                                "url": RegionComputeLink(
+                                    project, "subnetworks", spec["name"], region
+                                )
+                            }
+                            for spec in specs
+                        ]
+                    },
+                    specs[0],
+                )
+            )
+    else:
+        for spec in mirrored_subnets:
+            resources.extend(
+                GenerateMirrorConfig(
+                    project,
+                    region,
+                    vpc_ref,
+                    TRAFFIC_MIRROR_COLLECTOR_NAME,
+                    spec["name"],
+                    RegionComputeLink(project, "subnetworks", spec["name"], region),
+                    spec,
+                )
+            )
+
+    # Mirror individual workloads by network tag and/or instance, rather than their whole subnet.
+    if mirrored_tags or mirrored_instance_refs:
+        mirrored_resources = {}
+        if mirrored_tags:
+            mirrored_resources["tags"] = mirrored_tags
+        if mirrored_instance_refs:
+            mirrored_resources["instances"] = [
+                {"url": instance_ref} for instance_ref in mirrored_instance_refs
+            ]
+        resources.append(
+            GenerateMirrorPolicy(
                 project,
                 region,
                 vpc_ref,
                 TRAFFIC_MIRROR_COLLECTOR_NAME,
-                subnet_name.strip(),
-                RegionComputeLink(project, "subnetworks", subnet_name.strip(), region),
+                TARGETS_MIRROR_NAME,
+                "Packet mirroring policy for tagged instances / listed instances.",
+                mirrored_resources,
             )
         )
 
@@ -35,13 +35,19 @@ def GenerateConfig(context):
     )
     ipv6 = gprop["ipv6-enable"]
 
+    # Further regions of the deployment share the VPC of the main region.
+    shared_vpc = "vpc-ref" in prop
+
     VPC_NAME = existing_vpc_name if existing_vpc_name else (name + "-vpc")
     SUBNET_NAME = name + "-vsensor-subnet"
     NAT_IP_NAME = name + "-nat-external-ip"
 
     resources = []
     # If customer provides an existing VPC to launch into, don't directly add it to the deployment, deployment manager will try to delete it.
-    if existing_vpc_name:
+    if shared_vpc:
+        network_ref = prop["vpc-ref"]
+        VPC_NAME = prop["vpc-name"]
+    elif existing_vpc_name:
         network_ref = GlobalComputeLink(project, "networks", existing_vpc_name)
     else:
         network_ref = getRef(VPC_NAME)
@@ -78,39 +84,49 @@ def GenerateConfig(context):
                     **ipv6_options,
                 },
             },
-            # https://cloud.google.com/iap/docs/using-tcp-forwarding
-            {
-                "name": name + "-firewall-ssh-iap",
-                "type": "compute.v1.firewall",
-                "properties": {
-                    "description": "vSensor Quickstart Firewall Policy for SSH-in-browser and IAP",
-                    "name": "Allow All Mirror Traffic",
-                    "priority": 1000,
-                    "network": network_ref,
-                    "sourceRanges": ["35.235.240.0/20"],
-                    # Apply firewall rule to only vSensors and bastion in MIG.
-                    "targetTags": ["darktrace-ssh-iap"],
-                    "logConfig": {"enable": False},
-                    "direction": "INGRESS",
-                    "allowed": [{"IPProtocol": "TCP", "ports": ["22"]}],
+        ]
+    )
+    # The firewall rules apply to the whole VPC, so are only created once.
+    if not shared_vpc:
+        resources.extend(
+            [
+                # https://cloud.google.com/iap/docs/using-tcp-forwarding
+                {
+                    "name": name + "-firewall-ssh-iap",
+                    "type": "compute.v1.firewall",
+                    "properties": {
+                        "description": "vSensor Quickstart Firewall Policy for SSH-in-browser and IAP",
+                        "name": "Allow All Mirror Traffic",
+                        "priority": 1000,
+                        "network": network_ref,
+                        "sourceRanges": ["35.235.240.0/20"],
+                        # Apply firewall rule to only vSensors and bastion in MIG.
+                        "targetTags": ["darktrace-ssh-iap"],
+                        "logConfig": {"enable": False},
+                        "direction": "INGRESS",
+                        "allowed": [{"IPProtocol": "TCP", "ports": ["22"]}],
+                    },
                 },
-            },
-            {
-                "name": name + "-firewall-packet-mirror-ipv4",
-                "type": "compute.v1.firewall",
-                "properties": {
-                    "name": "vSensor Quickstart Packet Mirroring Firewall Policy (IPv4)",
-                    "description": "Allow all packet mirror traffic to be ingested into the vSensors.",
-                    "priority": 1,  # GCP recommended this such that it always applies over other firewall rules.
-                    "network": network_ref,
-                    "sourceRanges": ["0.0.0.0/0"],
-                    # Apply firewall rule to only vSensors in private MIG.
-                    "targetTags": ["darktrace-vsensor-mirroring"],
-                    "logConfig": {"enable": False},
-                    "direction": "INGRESS",
-                    "allowed": [{"IPProtocol": "all"}],
+                {
+                    "name": name + "-firewall-packet-mirror-ipv4",
+                    "type": "compute.v1.firewall",
+                    "properties": {
+                        "name": "vSensor Quickstart Packet Mirroring Firewall Policy (IPv4)",
+                        "description": "Allow all packet mirror traffic to be ingested into the vSensors.",
+                        "priority": 1,  # GCP recommended this such that it always applies over other firewall rules.
+                        "network": network_ref,
+                        "sourceRanges": ["0.0.0.0/0"],
+                        # Apply firewall rule to only vSensors in private MIG.
+                        "targetTags": ["darktrace-vsensor-mirroring"],
+                        "logConfig": {"enable": False},
+                        "direction": "INGRESS",
+                        "allowed": [{"IPProtocol": "all"}],
+                    },
                 },
-            },
+            ]
+        )
+    resources.extend(
+        [
             {
                 "name": NAT_IP_NAME,
                 "type": "compute.v1.address",
@@ -142,7 +158,7 @@ def GenerateConfig(context):
             },
         ]
     )
-    if ipv6 and not existing_vpc_name:
+    if ipv6 and not existing_vpc_name and not shared_vpc:
         resources.extend(
             [
                 {
@@ -159,7 +175,7 @@ def GenerateConfig(context):
                 }
             ]
         )
-    if ipv6:
+    if ipv6 and not shared_vpc:
         resources.extend(
             [
                 {
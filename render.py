@@ -0,0 +1,300 @@
+# Copyright 2022 Darktrace Holdings Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Renders the Quick Start locally, without a round trip to Deployment Manager.
+
+A stand-in context is fed into the templates of a configuration (normally
+launch.yaml), nested templates are expanded recursively and references to
+template outputs are resolved, producing the flattened manifest Deployment
+Manager would deploy. References to properties of base resources (ie a service
+account email) are only known once deployed, so these are left in place.
+
+Usage:
+    python render.py --config launch.yaml --deployment <NAME> --project <PROJECT>
+"""
+
+import argparse
+import copy
+import importlib
+import os
+import re
+import sys
+import time
+
+import yaml
+
+# $(ref.RESOURCE.OUTPUT), as built by common.getRef
+REF_PATTERN = re.compile(r"\$\(ref\.([^.)]+)\.([^)]+)\)")
+
+
+class Context(object):
+    """Stand-in for the context Deployment Manager passes into templates."""
+
+    def __init__(self, env, properties):
+        self.env = env
+        self.properties = properties
+
+
+class RenderState(object):
+    """Template outputs and expanded resource names collected during a render."""
+
+    def __init__(self, env, template_dir, imports):
+        self.env = env
+        self.template_dir = template_dir
+        # Template types the configuration imports, as Deployment Manager only resolves these.
+        self.imports = imports
+        # Template name -> {output name: value}
+        self.outputs = {}
+        # Template name -> names of the base resources it expanded into
+        self.template_resources = {}
+
+
+def is_template(resource):
+    return resource["type"].endswith(".py")
+
+
+def load_template(template_dir, template_type):
+    """Imports a template module (ie launch.py) from the template directory."""
+    if template_dir not in sys.path:
+        sys.path.insert(0, template_dir)
+    return importlib.import_module(os.path.splitext(template_type)[0])
+
+
+def apply_schema(template_dir, template_type, name, properties):
+    """Applies schema defaults and required properties, as Deployment Manager does."""
+    schema_path = os.path.join(template_dir, template_type + ".schema")
+    if not os.path.exists(schema_path):
+        return properties
+
+    with open(schema_path) as schema_file:
+        schema = yaml.safe_load(schema_file)
+
+    for key, definition in schema.get("properties", {}).items():
+        if key not in properties and "default" in definition:
+            properties[key] = copy.deepcopy(definition["default"])
+
+    missing = [key for key in schema.get("required", []) if key not in properties]
+    if missing:
+        raise Exception(
+            "Resource {} is missing required properties: {}".format(
+                name, ", ".join(missing)
+            )
+        )
+    return properties
+
+
+def find_refs(value):
+    """Returns all (resource, output) references within a property value."""
+    if isinstance(value, dict):
+        return [ref for item in value.values() for ref in find_refs(item)]
+    if isinstance(value, list):
+        return [ref for item in value for ref in find_refs(item)]
+    if isinstance(value, str):
+        return REF_PATTERN.findall(value)
+    return []
+
+
+def resolve_refs(value, state):
+    """Substitutes references to template outputs with their values."""
+    if isinstance(value, dict):
+        return {key: resolve_refs(item, state) for key, item in value.items()}
+    if isinstance(value, list):
+        return [resolve_refs(item, state) for item in value]
+    if not isinstance(value, str):
+        return value
+
+    def lookup(match):
+        resource, output = match.groups()
+        if output in state.outputs.get(resource, {}):
+            result = state.outputs[resource][output]
+            # Deployment Manager keeps non-string outputs (ie lists) when used as the whole value.
+            if match.group(0) == value:
+                return result
+            return str(result)
+        return match.group(0)
+
+    # Outputs may themselves reference other template outputs.
+    for _ in range(10):
+        if not isinstance(value, str):
+            return value
+        match = REF_PATTERN.fullmatch(value)
+        if match:
+            resolved = lookup(match)
+        else:
+            resolved = REF_PATTERN.sub(lookup, value)
+        if resolved == value:
+            return value
+        value = resolved
+    return value
+
+
+def render_template(resource, state):
+    """Runs a single template, returning its resources and outputs."""
+    name = resource["name"]
+    template_type = resource["type"]
+    if template_type not in state.imports:
+        raise Exception(
+            "Resource {} uses template {}, which is not in the configuration imports.".format(
+                name, template_type
+            )
+        )
+    module = load_template(state.template_dir, template_type)
+
+    properties = resolve_refs(copy.deepcopy(resource.get("properties", {})), state)
+    properties = apply_schema(state.template_dir, template_type, name, properties)
+
+    env = dict(state.env, name=name, type=template_type)
+    context = Context(env, properties)
+    if hasattr(module, "GenerateConfig"):
+        config = module.GenerateConfig(context)
+    else:
+        config = module.generate_config(context)
+
+    if isinstance(config, str):
+        config = yaml.safe_load(config)
+    return config.get("resources", []), config.get("outputs", [])
+
+
+def expand(resources, state):
+    """Recursively expands templates, in the order their output references allow."""
+    flattened = []
+    pending = list(resources)
+    while pending:
+        pending_templates = set(r["name"] for r in pending if is_template(r))
+        ready = [
+            r
+            for r in pending
+            if not is_template(r)
+            or not any(
+                ref[0] in pending_templates and ref[0] != r["name"]
+                for ref in find_refs(r.get("properties", {}))
+            )
+        ]
+        if not ready:
+            raise Exception(
+                "Circular references between templates: "
+                + ", ".join(sorted(pending_templates))
+            )
+
+        for resource in ready:
+            pending.remove(resource)
+            if not is_template(resource):
+                flattened.append(resource)
+                continue
+
+            children, outputs = render_template(resource, state)
+            children_flattened = expand(children, state)
+            # Dependencies of a template apply to every resource within it.
+            template_depends_on = resource.get("metadata", {}).get("dependsOn", [])
+            if template_depends_on:
+                for child in children_flattened:
+                    child_metadata = child.setdefault("metadata", {})
+                    child_metadata["dependsOn"] = (
+                        child_metadata.get("dependsOn", []) + template_depends_on
+                    )
+            state.template_resources[resource["name"]] = [
+                r["name"] for r in children_flattened
+            ]
+            state.outputs[resource["name"]] = {
+                output["name"]: resolve_refs(output["value"], state)
+                for output in outputs
+            }
+            flattened.extend(children_flattened)
+
+    return flattened
+
+
+def expand_depends_on(resource, state):
+    """Depending on a template is depending on every resource it expanded into."""
+    depends_on = resource.get("metadata", {}).get("dependsOn")
+    if not depends_on:
+        return resource
+
+    expanded = []
+    for dependency in depends_on:
+        for name in state.template_resources.get(dependency, [dependency]):
+            if name not in expanded:
+                expanded.append(name)
+    resource["metadata"]["dependsOn"] = expanded
+    return resource
+
+
+def render(config, deployment, project, template_dir="."):
+    """Renders a configuration into a flattened Deployment Manager manifest."""
+    env = {
+        "deployment": deployment,
+        "project": project,
+        "project_number": "000000000000",
+        "current_time": int(time.time()),
+        "username": "render",
+    }
+    imports = set(item["path"] for item in config.get("imports", []))
+    state = RenderState(env, os.path.abspath(template_dir), imports)
+
+    resources = expand(config.get("resources", []), state)
+    resources = [expand_depends_on(resolve_refs(r, state), state) for r in resources]
+
+    outputs = []
+    for resource in config.get("resources", []):
+        for output_name, value in state.outputs.get(resource["name"], {}).items():
+            outputs.append({"name": output_name, "value": value})
+
+    return {"resources": resources, "outputs": outputs}
+
+
+def load_config(path):
+    with open(path) as config_file:
+        return yaml.safe_load(config_file)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Render the vSensor Quick Start locally into a flattened manifest."
+    )
+    parser.add_argument("--config", default="launch.yaml", help="Configuration file.")
+    parser.add_argument(
+        "--deployment", default="vsensor-quickstart", help="Deployment name."
+    )
+    parser.add_argument("--project", default="my-project", help="GCP project ID.")
+    parser.add_argument(
+        "--output", "-o", help="File to write the manifest to (default stdout)."
+    )
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    config = load_config(args.config)
+    manifest = render(
+        config,
+        args.deployment,
+        args.project,
+        os.path.dirname(os.path.abspath(args.config)),
+    )
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    rendered = yaml.safe_dump(manifest, default_flow_style=False, sort_keys=False)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(rendered)
+    else:
+        sys.stdout.write(rendered)
+
+    sys.stderr.write(
+        "Rendered {} resources in {:.1f}ms\n".format(
+            len(manifest["resources"]), elapsed_ms
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -18,6 +18,8 @@ the vSensor service account."""
 
 import re
 
+from common import PCAP_STORAGE_CLASSES
+
 
 def GenerateConfig(context):
     """Generates YAML resource configuration."""
@@ -35,10 +37,40 @@ def GenerateConfig(context):
 
     retention_time_days = gprop["pcap-retention-time-days"]
     retention_time_secs = retention_time_days * 24 * 60 * 60
+    storage_class_transitions = gprop["pcap-storage-class-transitions"]
+    autoclass = gprop["pcap-storage-autoclass"]
 
     BUCKET_NAME = name + "-bucket"
+
+    lifecycle_rules = [
+        {
+            "action": {"type": "Delete"},
+            "condition": {"age": retention_time_days},
+        }
+    ]
+    # Move PCAPs to colder storage classes as they age, recent PCAPs are recalled the most.
+    for transition in storage_class_transitions:
+        storage_class = transition["storage-class"]
+        lifecycle_rules.append(
+            {
+                "action": {"type": "SetStorageClass", "storageClass": storage_class},
+                "condition": {
+                    "age": transition["age-days"],
+                    "matchesStorageClass": PCAP_STORAGE_CLASSES[
+                        : PCAP_STORAGE_CLASSES.index(storage_class)
+                    ],
+                },
+            }
+        )
     IAM_ROLE_NAME = deployment_hash + "_vsensor_storage"
 
+    autoclass_options = {}
+    if autoclass:
+        # Alternatively let Autoclass move each PCAP between classes by how recently it was read.
+        autoclass_options = {
+            "autoclass": {"enabled": True, "terminalStorageClass": autoclass}
+        }
+
     resources = [
         {
             "name": IAM_ROLE_NAME,
@@ -63,16 +95,10 @@ def GenerateConfig(context):
                     "uniformBucketLevelAccess": {"enabled": True},
                 },
                 "location": region,
-                "lifecycle": {
-                    "rule": [
-                        {
-                            "action": {"type": "Delete"},
-                            "condition": {"age": retention_time_days},
-                        }
-                    ]
-                },
+                "lifecycle": {"rule": lifecycle_rules},
                 "retentionPolicy": {"retentionPeriod": retention_time_secs},
                 "storageClass": "STANDARD",
+                **autoclass_options,
             },
             "accessControl": {
                 "gcpIamPolicy": {
@@ -0,0 +1,75 @@
+# Copyright 2022 Darktrace Holdings Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Checks the critical path of the example launch.yaml, so changes that serialize
+the deployment (ie a new dependency on the vSensor MIG) are caught.
+
+Usage:
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+
+TEMPLATE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TEMPLATE_DIR)
+
+from critical_path import analyze  # noqa: E402
+from render import load_config, render  # noqa: E402
+
+
+class CriticalPathTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        manifest = render(
+            load_config(os.path.join(TEMPLATE_DIR, "launch.yaml")),
+            "vsensor-quickstart",
+            "my-project",
+            TEMPLATE_DIR,
+        )
+        cls.analysis = analyze(manifest)
+
+    def test_predicted_time(self):
+        self.assertEqual(self.analysis["predicted-secs"], 210)
+        self.assertEqual(self.analysis["serial-secs"], 585)
+
+    def test_critical_path(self):
+        self.assertEqual(
+            [
+                (step["type"], step["finish-secs"])
+                for step in self.analysis["critical-path"]
+            ],
+            [
+                ("compute.v1.network", 30),
+                ("compute.v1.subnetwork", 50),
+                ("compute.v1.instanceTemplate", 60),
+                ("compute.beta.regionInstanceGroupManager", 120),
+                ("compute.v1.regionBackendService", 150),
+                ("compute.v1.forwardingRule", 180),
+                ("gcp-types/compute-v1:packetMirrorings", 210),
+            ],
+        )
+        self.assertEqual(
+            self.analysis["critical-path"][-1]["name"],
+            "mirror-vsensor-quickstart-bastion-subnet",
+        )
+
+    def test_storage_created_first(self):
+        # The PCAP bucket must not wait on the vSensor MIG it is used by.
+        self.assertIn("vsensor-quickstart-storage-bucket", self.analysis["waves"][0])
+
+
+if __name__ == "__main__":
+    unittest.main()
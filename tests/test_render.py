@@ -0,0 +1,206 @@
+# Copyright 2022 Darktrace Holdings Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Checks the offline render of render.py: reference resolution, nested template
+expansion, schema defaults and the errors Deployment Manager would also give.
+
+Usage:
+    python -m unittest discover tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+TEMPLATE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TEMPLATE_DIR)
+
+from render import RenderState, expand, render, resolve_refs  # noqa: E402
+
+# Small templates, named so they are not confused with the Quick Start's own modules.
+NETWORK_TEMPLATE = '''
+def GenerateConfig(context):
+    name = context.env["name"]
+    return {
+        "resources": [
+            {"name": name + "-vpc", "type": "compute.v1.network", "properties": {}}
+        ],
+        "outputs": [
+            {"name": "vpc-ref", "value": "$(ref." + name + "-vpc.selfLink)"},
+            {"name": "zones", "value": context.properties["zones"]},
+        ],
+    }
+'''
+NETWORK_SCHEMA = """
+properties:
+  zones:
+    type: array
+    default: [europe-west2-a, europe-west2-b]
+"""
+SUBNET_TEMPLATE = '''
+def GenerateConfig(context):
+    return {
+        "resources": [
+            {
+                "name": context.env["name"] + "-subnet",
+                "type": "compute.v1.subnetwork",
+                "properties": {
+                    "network": context.properties["vpc-ref"],
+                    "zones": context.properties["zones"],
+                },
+            }
+        ]
+    }
+'''
+SUBNET_SCHEMA = """
+required:
+  - vpc-ref
+"""
+
+
+class ResolveRefsTest(unittest.TestCase):
+    def setUp(self):
+        self.state = RenderState({}, TEMPLATE_DIR, set())
+        self.state.outputs = {
+            "net": {
+                "vpc-name": "demo-vpc",
+                "zones": ["europe-west2-a", "europe-west2-b"],
+                "vpc-ref": "$(ref.other.vpc-link)",
+            },
+            "other": {"vpc-link": "https://example/demo-vpc"},
+        }
+
+    def test_whole_value_keeps_output_type(self):
+        self.assertEqual(
+            resolve_refs("$(ref.net.zones)", self.state),
+            ["europe-west2-a", "europe-west2-b"],
+        )
+
+    def test_embedded_reference_is_substituted(self):
+        self.assertEqual(
+            resolve_refs("projects/p/networks/$(ref.net.vpc-name)", self.state),
+            "projects/p/networks/demo-vpc",
+        )
+
+    def test_chained_references(self):
+        self.assertEqual(
+            resolve_refs({"network": ["$(ref.net.vpc-ref)"]}, self.state),
+            {"network": ["https://example/demo-vpc"]},
+        )
+
+    def test_base_resource_reference_is_kept(self):
+        # Properties of base resources are only known once deployed.
+        self.assertEqual(
+            resolve_refs("$(ref.my-sa.email)", self.state), "$(ref.my-sa.email)"
+        )
+
+
+class ExpandTest(unittest.TestCase):
+    def setUp(self):
+        self.template_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.template_dir)
+        self.addCleanup(sys.modules.pop, "render_test_network", None)
+        self.addCleanup(sys.modules.pop, "render_test_subnet", None)
+        for file_name, content in [
+            ("render_test_network.py", NETWORK_TEMPLATE),
+            ("render_test_network.py.schema", NETWORK_SCHEMA),
+            ("render_test_subnet.py", SUBNET_TEMPLATE),
+            ("render_test_subnet.py.schema", SUBNET_SCHEMA),
+        ]:
+            path = os.path.join(self.template_dir, file_name)
+            with open(path, "w") as template_file:
+                template_file.write(content)
+        self.imports = [
+            {"path": "render_test_network.py"},
+            {"path": "render_test_subnet.py"},
+        ]
+        self.state = RenderState(
+            {}, self.template_dir, {"render_test_network.py", "render_test_subnet.py"}
+        )
+
+    def subnet(self, properties, depends_on=None):
+        resource = {
+            "name": "sub",
+            "type": "render_test_subnet.py",
+            "properties": properties,
+        }
+        if depends_on:
+            resource["metadata"] = {"dependsOn": depends_on}
+        return resource
+
+    def test_expands_in_reference_order(self):
+        # The subnet template is listed first, but needs the network template's outputs.
+        manifest = render(
+            {
+                "imports": self.imports,
+                "resources": [
+                    self.subnet(
+                        {"vpc-ref": "$(ref.net.vpc-ref)", "zones": "$(ref.net.zones)"},
+                        depends_on=["net"],
+                    ),
+                    {"name": "net", "type": "render_test_network.py"},
+                ],
+            },
+            "demo",
+            "my-project",
+            self.template_dir,
+        )
+        resources = {r["name"]: r for r in manifest["resources"]}
+        self.assertEqual(list(resources), ["net-vpc", "sub-subnet"])
+        self.assertEqual(
+            resources["sub-subnet"]["properties"],
+            {
+                # Schema default of the network template, output as a list.
+                "zones": ["europe-west2-a", "europe-west2-b"],
+                "network": "$(ref.net-vpc.selfLink)",
+            },
+        )
+        # Depending on a template is depending on every resource it expanded into.
+        self.assertEqual(resources["sub-subnet"]["metadata"]["dependsOn"], ["net-vpc"])
+        self.assertIn(
+            {"name": "vpc-ref", "value": "$(ref.net-vpc.selfLink)"}, manifest["outputs"]
+        )
+
+    def test_missing_required_property(self):
+        with self.assertRaisesRegex(Exception, "missing required properties: vpc-ref"):
+            expand([self.subnet({})], self.state)
+
+    def test_template_not_imported(self):
+        state = RenderState({}, self.template_dir, {"render_test_subnet.py"})
+        with self.assertRaisesRegex(Exception, "not in the configuration imports"):
+            expand([{"name": "net", "type": "render_test_network.py"}], state)
+
+    def test_circular_references(self):
+        with self.assertRaisesRegex(Exception, "Circular references between templates"):
+            expand(
+                [
+                    {
+                        "name": "a",
+                        "type": "render_test_subnet.py",
+                        "properties": {"vpc-ref": "$(ref.b.vpc-ref)"},
+                    },
+                    {
+                        "name": "b",
+                        "type": "render_test_subnet.py",
+                        "properties": {"vpc-ref": "$(ref.a.vpc-ref)"},
+                    },
+                ],
+                self.state,
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
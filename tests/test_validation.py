@@ -0,0 +1,181 @@
+# Copyright 2022 Darktrace Holdings Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Checks that launch.py validation rejects configurations GCP would only reject
+part way through a deployment.
+
+Usage:
+    python -m unittest discover tests
+"""
+
+import copy
+import os
+import sys
+import unittest
+
+TEMPLATE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TEMPLATE_DIR)
+
+from launch import validation  # noqa: E402
+from render import Context, apply_schema, load_config  # noqa: E402
+
+
+class ValidationTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Properties of the example launch.yaml, with the schema defaults.
+        config = load_config(os.path.join(TEMPLATE_DIR, "launch.yaml"))
+        launch = [r for r in config["resources"] if r["type"] == "launch.py"][0]
+        cls.properties = apply_schema(
+            TEMPLATE_DIR, "launch.py", launch["name"], launch["properties"]
+        )
+
+    def validate(self, **properties):
+        context = Context(
+            {"deployment": "vsensor-quickstart", "project": "my-project"},
+            dict(copy.deepcopy(self.properties), **properties),
+        )
+        return validation(context)
+
+    def assertRejected(self, message, **properties):
+        with self.assertRaisesRegex(Exception, message):
+            self.validate(**properties)
+
+    def test_example_passes(self):
+        self.assertEqual(self.validate(), [])
+
+    def test_deployment_name_too_long(self):
+        context = Context(
+            {"deployment": "d" * 40, "project": "my-project"},
+            copy.deepcopy(self.properties),
+        )
+        with self.assertRaisesRegex(Exception, "Choose a name 29 characters or less"):
+            validation(context)
+
+    def test_tier1_networking(self):
+        self.assertRejected(
+            "Tier_1 networking requires the gVNIC",
+            **{"mig-instance-type": "n2-standard-32", "mig-tier1-networking": True}
+        )
+        self.assertRejected(
+            "Tier_1 networking is not available for n2d-standard-32",
+            **{
+                "mig-instance-type": "n2d-standard-32",
+                "mig-nic-type": "GVNIC",
+                "mig-tier1-networking": True,
+            }
+        )
+        self.validate(
+            **{
+                "mig-instance-type": "c2-standard-30",
+                "mig-nic-type": "GVNIC",
+                "mig-tier1-networking": True,
+            }
+        )
+
+    def test_canary_requires_previous_template(self):
+        self.assertRejected(
+            "mig-update-canary-size requires mig-previous-template",
+            **{"mig-update-canary-size": "10%"}
+        )
+        self.assertRejected(
+            "mig-update-canary-size must be a number of instances or a percentage",
+            **{
+                "mig-update-canary-size": "150%",
+                "mig-previous-template": {"name": "vsensor-quickstart-template"},
+            }
+        )
+
+    def test_rolling_update_must_replace(self):
+        self.assertRejected(
+            "mig-update-max-surge must be above 0",
+            **{"mig-update-max-unavailable": 0}
+        )
+        self.assertRejected(
+            "mig-update-max-surge must be 0 or at least 2",
+            **{"mig-update-max-surge": 1}
+        )
+
+    def test_ops_agent_logging(self):
+        self.assertRejected(
+            "ops-agent-logging disabled-receivers must be from",
+            **{"ops-agent-logging": {"disabled-receivers": ["vsensor-nginx"]}}
+        )
+        self.assertRejected(
+            "access-log-sample-percent must be a multiple of 10",
+            **{"ops-agent-logging": {"access-log-sample-percent": 25}}
+        )
+        # Patterns are escaped for the Ops Agent config, so any regex is accepted.
+        patterns = ["\\d+\\.\\d+", "it's \"$x\""]
+        self.validate(**{"ops-agent-logging": {"exclude-patterns": patterns}})
+
+    def test_local_ssds(self):
+        self.assertRejected(
+            "Local SSDs are only available for n2/n2d/c2",
+            **{"mig-local-ssd-count": 1}
+        )
+        self.assertRejected(
+            "c2-standard-30 vSensors can only have 4/8 local SSDs",
+            **{"mig-instance-type": "c2-standard-30", "mig-local-ssd-count": 2}
+        )
+        self.assertRejected(
+            "vSensors with local SSDs cannot be kept in a standby pool",
+            **{
+                "mig-instance-type": "n2-standard-8",
+                "mig-local-ssd-count": 1,
+                "mig-standby-stopped-size": 2,
+            }
+        )
+
+    def test_additional_regions(self):
+        region = {
+            "zone1": "us-east1-b",
+            "zone2": "us-east1-c",
+            "mig-subnet-cidr": "10.127.2.128/25",
+        }
+        self.assertRejected(
+            "vSensor subnet 10.127.2.128/25 in us-east1 overlaps",
+            **{"additional-regions": [region]}
+        )
+        self.assertRejected(
+            "Region europe-west2 is deployed more than once",
+            **{
+                "additional-regions": [
+                    dict(
+                        region,
+                        zone1="europe-west2-a",
+                        zone2="europe-west2-b",
+                        **{"mig-subnet-cidr": "10.128.0.0/24"}
+                    )
+                ]
+            }
+        )
+        region["mig-subnet-cidr"] = "10.128.0.0/24"
+        self.validate(**{"additional-regions": [region]})
+
+    def test_connection_tracking_idle_timeout(self):
+        self.assertRejected(
+            "idle-timeout-sec must be at least 600",
+            **{
+                "lb-session-affinity": "CLIENT_IP",
+                "lb-connection-tracking": {
+                    "tracking-mode": "PER_SESSION",
+                    "idle-timeout-sec": 300,
+                },
+            }
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()